@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from collections.abc import Sequence
+from typing import Any
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from anki_formatter.formatters import FORMATTERS
+from anki_formatter.formatters.image_occlusion_svg import format_image_occlusion_svg
+from benchmarks.corpus import generate_corpus
+from benchmarks.corpus import GENERATORS
+from benchmarks.corpus import website_title
+
+DEFAULT_SIZES = (100, 1000)
+
+
+def _format_svg(value: str, minimized: bool) -> tuple[str, bool]:
+    formatted_value = format_image_occlusion_svg(value)
+
+    return formatted_value, value != formatted_value
+
+
+def _website(url: str, timeout: int | None = None) -> Mock:
+    # links are benchmarked without network access
+    response = Mock()
+    response.text = f"<html><title>{website_title(url)}</title></html>"
+
+    return response
+
+
+def _formatter(name: str) -> Callable[[str, bool], tuple[str, bool]]:
+    # the field formatter reads and writes media files, the svg formatter does the work
+    return _format_svg if name == "imageOcclusionSVG" else FORMATTERS[name]
+
+
+def _run(
+    formatter: Callable[[str, bool], tuple[str, bool]],
+    corpus: list[str],
+    minimized: bool,
+) -> tuple[list[str], int]:
+    formatted_values = []
+    changed = 0
+
+    for value in corpus:
+        formatted_value, did_format = formatter(value, minimized)
+        formatted_values.append(formatted_value)
+        changed += did_format
+
+    return formatted_values, changed
+
+
+def _measure(
+    formatter: Callable[[str, bool], tuple[str, bool]],
+    corpus: list[str],
+    minimized: bool,
+    repeat: int,
+) -> dict[str, Any]:
+    size = sum(len(value.encode("utf-8")) for value in corpus)
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _run(formatter, corpus, minimized)
+        seconds.append(time.perf_counter() - start)
+
+    # tracing slows the formatters down, memory is measured in a separate run
+    tracemalloc.start()
+    try:
+        _, changed = _run(formatter, corpus, minimized)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(seconds)
+
+    return {
+        "fields": len(corpus),
+        "bytes": size,
+        "changed": changed,
+        "seconds": round(best, 6),
+        "medianSeconds": round(sorted(seconds)[len(seconds) // 2], 6),
+        "fieldsPerSecond": round(len(corpus) / best, 1) if best else None,
+        "megabytesPerSecond": round(size / best / 1e6, 3) if best else None,
+        "peakMemoryBytes": peak,
+    }
+
+
+def benchmark(
+    formatters: Sequence[str],
+    sizes: Sequence[int],
+    *,
+    seed: int,
+    minimized: bool,
+    repeat: int,
+    on_result: Callable[[dict[str, Any]], None],
+) -> dict[str, Any]:
+    results = []
+
+    with patch("anki_formatter.formatters.common.requests.get", _website):
+        for name in formatters:
+            formatter = _formatter(name)
+
+            for size in sizes:
+                corpus = generate_corpus(name, size, seed)
+                formatted_corpus, _ = _run(formatter, corpus, minimized)
+
+                # raw fields as written by the editor and fields that were already formatted
+                result = {
+                    "formatter": name,
+                    "size": size,
+                    "raw": _measure(formatter, corpus, minimized, repeat),
+                    "canonical": _measure(formatter, formatted_corpus, minimized, repeat),
+                }
+                results.append(result)
+                on_result(result)
+
+    return {
+        "seed": seed,
+        "minimized": minimized,
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def _results_by_key(report: dict[str, Any]) -> dict[tuple[str, int], dict[str, Any]]:
+    return {(result["formatter"], result["size"]): result for result in report["results"]}
+
+
+def _write_result(result: dict[str, Any], baseline: dict[str, Any] | None) -> None:
+    line = (
+        f"{result['formatter']:<18} {result['size']:>7} "
+        f"{result['raw']['fieldsPerSecond']:>12} fields/s "
+        f"{result['canonical']['fieldsPerSecond']:>12} fields/s (canonical) "
+        f"{result['raw']['peakMemoryBytes'] / 1e6:>8.1f} MB"
+    )
+
+    if baseline is not None:
+        baseline_result = _results_by_key(baseline).get((result["formatter"], result["size"]))
+        if baseline_result is not None:
+            speedup = baseline_result["raw"]["seconds"] / result["raw"]["seconds"]
+            line += f" {speedup:>6.2f}x"
+
+    sys.stdout.write(f"{line}\n")
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="benchmarks",
+        description="Measure throughput and memory of the formatters on a synthetic corpus.",
+    )
+    parser.add_argument(
+        "--formatters",
+        nargs="+",
+        choices=sorted(GENERATORS),
+        default=sorted(GENERATORS),
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--minimized", action="store_true")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="report the speedup over this earlier JSON report")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    formatters = args.formatters
+    if args.minimized:
+        # occlusion fields have no minimized form
+        formatters = [name for name in formatters if name != "occlusion"]
+
+    report = benchmark(
+        formatters,
+        args.sizes,
+        seed=args.seed,
+        minimized=args.minimized,
+        repeat=args.repeat,
+        on_result=lambda result: _write_result(result, baseline),
+    )
+
+    if args.output:
+        with open(args.output, mode="w", encoding="utf-8") as f:
+            f.write(json.dumps(report, indent=2))
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
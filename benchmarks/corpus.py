@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import random
+from collections.abc import Callable
+
+WORDS = (
+    "Zelle",
+    "Membran",
+    "Golgi-Apparat",
+    "Mitochondrium",
+    "Ribosom",
+    "Protein",
+    "Synthese",
+    "Rezeptor",
+    "Enzym",
+    "Hemmung",
+    "Niere",
+    "Leber",
+    "Glomerulus",
+    "Filtration",
+    "Aldosteron",
+    "Natrium",
+    "Kalium",
+    "Insulin",
+    "Glukose",
+    "Therapie",
+    "Diagnose",
+    "Symptom",
+    "akut",
+    "chronisch",
+    "bei",
+    "und",
+    "oder",
+    "mit",
+    "durch",
+    "die",
+    "der",
+    "das",
+)
+
+FORMULAS = (
+    r"\(x^2 + y_{i}\)",
+    r"\(\frac{a}{b}\)",
+    r"\[c = \sqrt{a^2 + b^2}\]",
+    r"\(K_m = \frac{k_{-1} + k_2}{k_1}\)",
+    r"\(pH = pK_s + \log \frac{[A^-]}{[HA]}\)",
+)
+
+CHEMICALS = (
+    "H<sub>2</sub>O",
+    "CO<sub>2</sub>",
+    "Ca<sup>2+</sup>",
+    "NAD<sup>+</sup>",
+    "P<sub>i</sub>",
+    "HCO<sub>3</sub><sup>-</sup>",
+)
+
+INLINE_TAGS = ("b", "strong", "i", "em", "u", "sub", "sup")
+
+STYLES = (
+    "text-align: center;",
+    "text-align: right; color: rgb(0, 0, 0);",
+    "white-space: nowrap;",
+    "font-size: 12px; text-align: left;",
+    "background-color: #ffffff;",
+)
+
+WEBSITES = (
+    ("https://de.wikipedia.org/wiki/{}", "{} – Wikipedia"),
+    ("https://flexikon.doccheck.com/de/{}", "{} - DocCheck Flexikon"),
+    (
+        "https://www.gelbe-liste.de/wirkstoffe/{}_231",
+        "{} - Anwendung, Wirkung, Nebenwirkungen | Gelbe Liste",
+    ),
+    ("https://www.gelbe-liste.de/produkte/{}-Tabletten_541825", "{} | Gelbe Liste"),
+    ("https://www.embryotox.de/arzneimittel/details/ansicht/medikament/{}", "Embryotox - {}"),
+)
+
+SOURCES = ("AMBOSS", "DocCheck", "Wikipedia", "via medici")
+
+DATE_FORMATS = ("%d.%m.%Y", "%d/%m/%Y", "%m/%Y", "%d.%m.%y", "%m/%y")
+
+
+def _words(rng: random.Random, min_words: int = 1, max_words: int = 8) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def _inline(rng: random.Random) -> str:
+    parts = []
+
+    for _ in range(rng.randint(1, 6)):
+        kind = rng.random()
+        if kind < 0.45:
+            parts.append(_words(rng))
+        elif kind < 0.65:
+            tag = rng.choice(INLINE_TAGS)
+            parts.append(f"<{tag}>{_words(rng, max_words=3)}</{tag}>")
+        elif kind < 0.75:
+            parts.append(f"{{{{c{rng.randint(1, 9)}::{_words(rng, max_words=3)}}}}}")
+        elif kind < 0.8:
+            hint = _words(rng, max_words=2)
+            parts.append(f"{{{{c{rng.randint(1, 9)}::{_words(rng, max_words=3)}::{hint}}}}}")
+        elif kind < 0.88:
+            parts.append(rng.choice(FORMULAS))
+        elif kind < 0.95:
+            parts.append(rng.choice(CHEMICALS))
+        else:
+            parts.append(f'<span style="{rng.choice(STYLES)}">{_words(rng)}</span>')
+
+    return rng.choice((" ", "&nbsp;", " ", "  ")).join(parts)
+
+
+def _list(rng: random.Random, depth: int = 0) -> str:
+    tag = rng.choice(("ul", "ol"))
+    items = []
+
+    for _ in range(rng.randint(2, 6)):
+        item = _inline(rng)
+        if depth < 3 and rng.random() < 0.3:
+            item += _list(rng, depth + 1)
+        items.append(f"<li>{item}</li>")
+
+    start = f' start="{rng.randint(2, 5)}"' if tag == "ol" and rng.random() < 0.2 else ""
+
+    return f"<{tag}{start}>{''.join(items)}</{tag}>"
+
+
+def _table(rng: random.Random) -> str:
+    columns = rng.randint(2, 6)
+    rows = []
+
+    for _ in range(rng.randint(2, 30)):
+        cells = []
+        remaining = columns
+        while remaining:
+            colspan = rng.randint(1, remaining) if rng.random() < 0.15 else 1
+            remaining -= colspan
+
+            cell_attrs = f' colspan="{colspan}"' if colspan > 1 else ""
+            if rng.random() < 0.3:
+                cell_attrs += f' style="{rng.choice(STYLES)}"'
+
+            cells.append(f"<td{cell_attrs}>{_inline(rng) if rng.random() < 0.9 else ''}</td>")
+        rows.append(f"<tr>{''.join(cells)}</tr>")
+
+    colgroup = ""
+    if rng.random() < 0.5:
+        widths = "".join(f'<col style="width: {rng.randint(50, 300)}px;">' for _ in range(columns))
+        colgroup = f"<colgroup>{widths}</colgroup>"
+
+    body = "".join(rows)
+
+    return f'<table style="width: 100%;" class="table">{colgroup}<tbody>{body}</tbody></table>'
+
+
+def _block(rng: random.Random) -> str:
+    kind = rng.random()
+
+    if kind < 0.45:
+        return f"<div>{_inline(rng)}</div>"
+    elif kind < 0.6:
+        return f"{_inline(rng)}<br>"
+    elif kind < 0.8:
+        return _list(rng)
+    elif kind < 0.9:
+        return _table(rng)
+    elif kind < 0.95:
+        return f'<img src="paste-{rng.getrandbits(64):016x}.jpg">'
+    else:
+        return "<div><br></div>"
+
+
+def html_field(rng: random.Random) -> str:
+    # most fields are short, some are long lists and tables
+    blocks = rng.choices((1, 2, 4, 12), weights=(50, 25, 15, 10))[0]
+
+    return "".join(_block(rng) for _ in range(rng.randint(1, blocks)))
+
+
+def table_field(rng: random.Random) -> str:
+    # long fields that consist of several large tables
+    return "".join(_table(rng) for _ in range(rng.randint(4, 12)))
+
+
+def _nested(rng: random.Random, depth: int) -> str:
+    if depth == 0:
+        return _inline(rng)
+
+    kind = rng.random()
+    inner = "".join(_nested(rng, depth - 1) for _ in range(rng.randint(1, 2)))
+
+    if kind < 0.3:
+        return f"<ul><li>{_inline(rng)}{inner}</li></ul>"
+    elif kind < 0.5:
+        return f"<table><tbody><tr><td>{inner}</td></tr></tbody></table>"
+    elif kind < 0.8:
+        tag = rng.choice(INLINE_TAGS)
+        return f"<{tag}>{inner}</{tag}>"
+    else:
+        return f"<div><span>{inner}</span></div>"
+
+
+def nested_field(rng: random.Random) -> str:
+    # deeply nested lists, tables and formatting tags as pasted from other applications
+    return _nested(rng, rng.randint(8, 12))
+
+
+def occlusion_field(rng: random.Random) -> str:
+    masks = [
+        f"{{{{c{index}::oa-{rng.getrandbits(32):08x}-{index}}}}}"
+        for index in range(1, rng.randint(2, 40))
+    ]
+    rng.shuffle(masks)
+
+    return rng.choice(("", " ", "<br>")).join(masks)
+
+
+def _mask(rng: random.Random, svg_id: str, index: int, width: int, height: int) -> str:
+    mask_width = round(rng.uniform(10, width / 4), rng.choice((0, 1, 3)))
+    mask_height = round(rng.uniform(10, height / 8), rng.choice((0, 1, 3)))
+    active = rng.random() < 0.1
+    class_attr = ' class="qshape"' if active else ""
+
+    return (
+        f'<rect id="{svg_id}-ao-{index}" '
+        f'x="{round(rng.uniform(-5, width - mask_width + 5), 2)}" '
+        f'y="{round(rng.uniform(-5, height - mask_height + 5), 2)}" '
+        f'width="{mask_width}" height="{mask_height}" '
+        f'fill="{"#FF7E7E" if active else "#FFEBA2"}" stroke="#2D2D2D" stroke-linecap="null"'
+        f"{class_attr}/>"
+    )
+
+
+def image_occlusion_svg(rng: random.Random) -> str:
+    svg_id = f"{rng.getrandbits(128):032x}"
+    width = rng.randint(300, 2000)
+    height = rng.randint(300, 3000)
+
+    # real occlusions range from a handful to several hundred masks
+    num_masks = rng.choices((5, 50, 300, 800), weights=(40, 35, 20, 5))[0]
+    masks = []
+    index = 1
+    while index <= num_masks:
+        if rng.random() < 0.05:
+            group_size = rng.randint(2, 8)
+            group = "".join(
+                _mask(rng, svg_id, index + offset, width, height) for offset in range(group_size)
+            )
+            masks.append(f'<g id="{svg_id}-ao-{index}">{group}</g>')
+            index += group_size
+        else:
+            masks.append(_mask(rng, svg_id, index, width, height))
+            index += 1
+
+    labels = "".join(
+        f'<text x="{round(rng.uniform(0, width), 1)}" y="{round(rng.uniform(0, height), 1)}" '
+        f'text-anchor="middle" font-family="Arial" font-size="{rng.randint(12, 32)}" '
+        f'fill="#000000">{_words(rng, max_words=2)}</text>'
+        for _ in range(rng.randint(0, 5))
+    )
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">'
+        "<!-- Created with Image Occlusion Enhanced -->"
+        f"<g><title>Labels</title>{labels}</g>"
+        f'<g><title>Masks</title>{"".join(masks)}</g>'
+        "</svg>"
+    )
+
+
+def link_field(rng: random.Random) -> str:
+    links = []
+
+    for _ in range(rng.randint(1, 4)):
+        url, _ = rng.choice(WEBSITES)
+        page = rng.choice(WORDS)
+        links.append(f'<a href="{url.format(page)}">{page}</a>')
+
+    return rng.choice(("<br>", "<br>\n")).join(links)
+
+
+def website_title(url: str) -> str:
+    for url_format, title_format in WEBSITES:
+        prefix, suffix = url_format.split("{}")
+        if url.startswith(prefix) and url.endswith(suffix):
+            start = len(prefix)
+            end = len(url) - len(suffix)
+            return title_format.format(url[start:end])
+
+    raise ValueError(url)
+
+
+def source_field(rng: random.Random) -> str:
+    return ", ".join(rng.sample(SOURCES, rng.randint(1, len(SOURCES))))
+
+
+def date_field(rng: random.Random) -> str:
+    date = f"{rng.randint(1, 28):02}.{rng.randint(1, 12):02}.{rng.randint(2015, 2025)}"
+    day, month, year = date.split(".")
+
+    return {
+        "%d.%m.%Y": date,
+        "%d/%m/%Y": f"{day}/{month}/{year}",
+        "%m/%Y": f"{month}/{year}",
+        "%d.%m.%y": f"{day}.{month}.{year[2:]}",
+        "%m/%y": f"{month}/{year[2:]}",
+    }[rng.choice(DATE_FORMATS)]
+
+
+def meditricks_field(rng: random.Random) -> str:
+    return rng.choice(
+        (
+            '<div class="mt-anki-iframe-src" data-src="{}"></div>',
+            '<div class="mt-anki-iframe-src" data-src=" {} "></div>\n',
+        ),
+    ).format(rng.randint(1, 99999))
+
+
+def plaintext_field(rng: random.Random) -> str:
+    return _inline(rng) if rng.random() < 0.7 else _words(rng)
+
+
+GENERATORS: dict[str, Callable[[random.Random], str]] = {
+    "clear": plaintext_field,
+    "plaintext": plaintext_field,
+    "html": html_field,
+    "skip": html_field,
+    "occlusion": occlusion_field,
+    "imageOcclusionSVG": image_occlusion_svg,
+    "source": source_field,
+    "date": date_field,
+    "meditricks": meditricks_field,
+    "links": link_field,
+}
+
+
+def generate_corpus(formatter: str, size: int, seed: int = 0) -> list[str]:
+    # every formatter has its own stream, adding a formatter does not change the other corpora
+    rng = random.Random(f"{seed}-{formatter}")
+
+    return [GENERATORS[formatter](rng) for _ in range(size)]
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from collections.abc import Callable
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from anki_formatter.formatters.html import HTMLParser
+from anki_formatter.formatters.html import postprocess
+from anki_formatter.formatters.html import preprocess
+from benchmarks.corpus import nested_field
+from benchmarks.corpus import table_field
+
+
+class Stage(NamedTuple):
+    field: Callable[[random.Random], str]
+    prepare: Callable[[str], str]
+    run: Callable[[str], object]
+
+
+def _emitted(value: str) -> str:
+    # postprocess gets the output of the parser
+    parser = HTMLParser()
+    parser.feed_tree(preprocess(value))
+
+    return parser.get_parsed_string()
+
+
+STAGES = {
+    "preprocess": Stage(nested_field, str, preprocess),
+    "postprocess": Stage(table_field, _emitted, postprocess),
+}
+
+
+def _measure(stage: Stage, inputs: list[str], repeat: int) -> float:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for value in inputs:
+            stage.run(value)
+        seconds.append(time.perf_counter() - start)
+
+    return min(seconds)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="benchmarks.stages",
+        description="Measure single stages of the html formatter on long fields.",
+    )
+    parser.add_argument("--stages", nargs="+", choices=sorted(STAGES), default=sorted(STAGES))
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for name in args.stages:
+        stage = STAGES[name]
+
+        rng = random.Random(f"{args.seed}-{name}")
+        inputs = [stage.prepare(stage.field(rng)) for _ in range(args.size)]
+        size = sum(len(value.encode("utf-8")) for value in inputs)
+
+        best = _measure(stage, inputs, args.repeat)
+        sys.stdout.write(
+            f"{name:<18} {args.size:>7} {best * 1000:>10.1f} ms "
+            f"{size / best / 1e6:>8.2f} MB/s\n",
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import sys
+from multiprocessing import parent_process
 
-if "pytest" not in sys.modules:
+# only set up the menus when loaded by Anki, not in tests, worker processes or the command line
+if "pytest" not in sys.modules and "aqt" in sys.modules and parent_process() is None:
     from aqt import gui_hooks
     from aqt.browser import Browser
 
+    from anki_formatter.main import format_on_blur
     from anki_formatter.main import main
+    from anki_formatter.main import main_dry_run
+    from anki_formatter.main import main_modified
+    from anki_formatter.main import track_editor
 
     def setup_menu(browser: Browser) -> None:
         format_action = browser.form.menuEdit.addAction("Format Notes (readable)")
@@ -15,4 +21,19 @@ if "pytest" not in sys.modules:
         format_action = browser.form.menuEdit.addAction("Format Notes (minimized)")
         format_action.triggered.connect(lambda _, b=browser: main(b, True))
 
+        format_action = browser.form.menuEdit.addAction("Preview Format Notes (readable)")
+        format_action.triggered.connect(lambda _, b=browser: main_dry_run(b, False))
+
+        format_action = browser.form.menuEdit.addAction("Preview Format Notes (minimized)")
+        format_action.triggered.connect(lambda _, b=browser: main_dry_run(b, True))
+
+        format_action = browser.form.menuEdit.addAction("Format Modified Notes (readable)")
+        format_action.triggered.connect(lambda _, b=browser: main_modified(b, False))
+
+        format_action = browser.form.menuEdit.addAction("Format Modified Notes (minimized)")
+        format_action.triggered.connect(lambda _, b=browser: main_modified(b, True))
+
     gui_hooks.browser_menus_did_init.append(setup_menu)
+
+    gui_hooks.editor_did_init.append(track_editor)
+    gui_hooks.editor_did_unfocus_field.append(format_on_blur)
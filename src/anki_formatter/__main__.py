@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from collections.abc import Sequence
+
+from anki.collection import Collection
+
+from anki_formatter.config import ConfigError
+from anki_formatter.config import load_config
+from anki_formatter.formatting import BatchFormatter
+from anki_formatter.formatting import FormattingError
+from anki_formatter.formatting import Options
+
+
+def _print_progress(processed: int, total: int, elapsed: float) -> None:
+    rate = processed / elapsed if elapsed else 0.0
+
+    sys.stderr.write(f"Formatted {processed} of {total} notes ({rate:.0f} notes/s)\n")
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="anki_formatter",
+        description="Format the notes of an Anki collection without running Anki.",
+    )
+    parser.add_argument("collection", help="path to the collection file (collection.anki2)")
+    parser.add_argument(
+        "--templates",
+        help="directory with the note type templates "
+        "(default: addons21/user_files/templates next to the profile folder)",
+    )
+    parser.add_argument("--search", default="", help="only format notes matching this search")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=1000,
+        help="only use the worker processes for at least this many notes (default: 1000)",
+    )
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--cache", help="path of the cache of already formatted values")
+    parser.add_argument("--minimized", action="store_true")
+    parser.add_argument(
+        "--stop-on-error",
+        action="store_true",
+        help="stop at the first field that cannot be formatted instead of skipping it",
+    )
+    parser.add_argument("--metrics", help="write timings and sizes per formatter to this file")
+    parser.add_argument(
+        "--dry-run",
+        metavar="REPORT",
+        help="do not change the collection, write a report of the changes to this file instead",
+    )
+    args = parser.parse_args(argv)
+
+    templates = args.templates or os.path.join(
+        os.path.dirname(os.path.abspath(args.collection)),
+        os.pardir,
+        "addons21",
+        "user_files",
+        "templates",
+    )
+
+    col = Collection(args.collection)
+    try:
+        formatter = BatchFormatter(
+            load_config(templates, col.models.all()),
+            Options(
+                minimized=args.minimized,
+                workers=args.workers,
+                threshold=args.threshold,
+                chunk_size=args.chunk_size,
+                cache_path=None if args.dry_run else args.cache,
+                dry_run=bool(args.dry_run),
+                metrics_path=args.metrics,
+                stop_on_error=args.stop_on_error,
+            ),
+            on_progress=_print_progress,
+        )
+        result = formatter.format_notes(col, col.find_notes(args.search))
+    except (ConfigError, FormattingError) as e:
+        sys.stderr.write(f"{e}\n")
+        return 1
+    finally:
+        col.close()
+
+    if result.report is not None:
+        with open(args.dry_run, mode="w", encoding="utf-8") as f:
+            f.write(result.report.to_json())
+
+        sys.stdout.write(f"{result.formatted} of {result.total} notes would be updated.\n")
+    else:
+        sys.stdout.write(f"Updated {result.formatted} of {result.total} notes.\n")
+
+    if result.speedup is not None:
+        sys.stdout.write(
+            f"Formatted with {args.workers} workers ({result.speedup:.1f}x speedup).\n"
+        )
+
+    for error in result.errors:
+        sys.stderr.write(f"Note {error.note_id}, {error.field}: {error.message}\n")
+
+    return 1 if result.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+
+from anki_formatter.formatters import VERSIONS
+
+
+def value_hash(value: str) -> bytes:
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+
+
+def _version(formatter: str) -> int:
+    return VERSIONS[formatter.partition(":")[0]]
+
+
+class CanonicalCache:
+    def __init__(self, path: str) -> None:
+        self.__connection = sqlite3.connect(path)
+        self.__connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS canonical (
+                hash BLOB NOT NULL,
+                formatter TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                minimized INTEGER NOT NULL,
+                PRIMARY KEY (hash, formatter, version, minimized)
+            ) WITHOUT ROWID
+            """,
+        )
+
+        # values are only canonical for the formatter version that produced them, formatters with a
+        # policy are stored as "<formatter>:<policy hash>"
+        for formatter, version in VERSIONS.items():
+            self.__connection.execute(
+                "DELETE FROM canonical WHERE (formatter = ? OR formatter LIKE ?) AND version != ?",
+                (formatter, f"{formatter}:%", version),
+            )
+        self.__connection.commit()
+
+    def is_canonical(self, formatter: str, value: str, minimized: bool) -> bool:
+        row = self.__connection.execute(
+            "SELECT 1 FROM canonical "
+            "WHERE hash = ? AND formatter = ? AND version = ? AND minimized = ?",
+            (value_hash(value), formatter, _version(formatter), minimized),
+        ).fetchone()
+
+        return row is not None
+
+    def add(self, formatter: str, value: str, minimized: bool) -> None:
+        self.__connection.execute(
+            "INSERT OR IGNORE INTO canonical VALUES (?, ?, ?, ?)",
+            (value_hash(value), formatter, _version(formatter), minimized),
+        )
+
+    def commit(self) -> None:
+        self.__connection.commit()
+
+    def close(self) -> None:
+        # uncommitted values are discarded
+        self.__connection.close()
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import json
+import os
+from collections.abc import Callable
+from functools import partial
+from typing import Any
+from typing import NamedTuple
+from typing import TYPE_CHECKING
+
+from anki_formatter.cache import value_hash
+from anki_formatter.formatters import FORMATTERS
+from anki_formatter.formatters.html import format_html
+from anki_formatter.formatters.html import html_policy
+from anki_formatter.formatters.skip import skip
+
+if TYPE_CHECKING:
+    from anki.models import NotetypeDict
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class FieldPlan(NamedTuple):
+    ord: int
+    name: str
+    formatter_name: str
+    cache_key: str  # results are only reused for the same formatter and policy
+    formatter: Callable[[str, bool], tuple[str, bool]]
+
+
+class Plan(NamedTuple):
+    fields: dict[int, list[FieldPlan]]  # the formatted fields per note type id
+    # the fields without a formatter per note type id, the error is only reported once one of their
+    # notes is formatted, so unused note types do not block any run
+    errors: dict[int, list[str]]
+
+
+# loaded configs and compiled plans per template directory, see load_config
+_CONFIGS: dict[
+    str,
+    tuple[
+        tuple[tuple[str, int, int], ...],
+        dict[str, dict[str, Callable[[str, bool], tuple[str, bool]]]],
+    ],
+] = {}
+# the editor compiles the plan of a single note type and the browser the plan of all note types,
+# so plans are kept per set of note type ids and replaced once one of the note types changes
+_PLANS: dict[tuple[str, tuple[int, ...]], tuple[object, Plan]] = {}
+
+
+def _compile_plan(
+    config: dict[str, dict[str, Callable[[str, bool], tuple[str, bool]]]],
+    note_types: list[NotetypeDict],
+) -> Plan:
+    formatter_names = {formatter: name for name, formatter in FORMATTERS.items()}
+
+    plan = Plan({}, {})
+
+    for note_type in note_types:
+        key = next((key for key in config if note_type["name"].startswith(key)), None)
+
+        if key is None:
+            continue
+
+        missing = [field["name"] for field in note_type["flds"] if field["name"] not in config[key]]
+        if missing:
+            plan.errors[note_type["id"]] = missing
+            continue
+
+        fields: list[FieldPlan] = []
+        for field in note_type["flds"]:
+            if (formatter := config[key][field["name"]]) is skip:
+                continue
+
+            # formatters with a policy are partials
+            formatter_name = formatter_names[getattr(formatter, "func", formatter)]
+            fields.append(
+                FieldPlan(
+                    ord=field["ord"],
+                    name=field["name"],
+                    formatter_name=formatter_name,
+                    cache_key=_cache_key(formatter_name, formatter),
+                    formatter=formatter,
+                ),
+            )
+
+        plan.fields[note_type["id"]] = fields
+
+    return plan
+
+
+def _cache_key(formatter_name: str, formatter: Callable[[str, bool], tuple[str, bool]]) -> str:
+    if not isinstance(formatter, partial):
+        return formatter_name
+
+    # the policy is a tuple of strings, so its repr is the same in every process and run
+    return f"{formatter_name}:{value_hash(repr(formatter.keywords)).hex()}"
+
+
+def _validate(data: object, path: str) -> dict[str, Any]:
+    if not isinstance(data, dict) or not isinstance(data.get("name"), str):
+        raise ConfigError(f'{path}: "name" must be a string.')
+
+    if not isinstance(data.get("fields"), list):
+        raise ConfigError(f'{path}: "fields" must be a list.')
+
+    for index, field in enumerate(data["fields"]):
+        if not isinstance(field, dict) or not isinstance(field.get("name"), str):
+            raise ConfigError(f'{path}: field {index} must have a "name".')
+
+        formatter = field.get("formatter", "skip")
+        if formatter not in FORMATTERS:
+            raise ConfigError(
+                f'{path}: unknown formatter "{formatter}" of field "{field["name"]}".'
+            )
+
+        if "policy" in field and formatter != "html":
+            raise ConfigError(
+                f'{path}: field "{field["name"]}" has a policy but no html formatter.'
+            )
+
+        if "policy" in field and not isinstance(field["policy"], dict):
+            raise ConfigError(f'{path}: "policy" of field "{field["name"]}" must be an object.')
+
+    return data
+
+
+def _field_formatter(field: dict[str, Any], path: str) -> Callable[[str, bool], tuple[str, bool]]:
+    if "policy" not in field:
+        return FORMATTERS[field.get("formatter", "skip")]
+
+    # the policy is read once per config, every process compiles it on its first call
+    try:
+        return partial(format_html, policy=html_policy(field["policy"]))
+    except ValueError as e:
+        raise ConfigError(f'{path}: invalid policy of field "{field["name"]}": {e}.') from e
+
+
+def _model_files(directory: str) -> tuple[tuple[str, int, int], ...]:
+    model_files = []
+
+    try:
+        folder_names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        raise ConfigError(f"{directory} does not exist.") from None
+
+    for folder_name in folder_names:
+        folder = os.path.join(directory, folder_name)
+
+        if not os.path.isdir(folder):
+            continue
+
+        if os.path.basename(folder) in (".git",):
+            continue
+
+        path = os.path.join(folder, "model.json")
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise ConfigError(f"{path} does not exist.") from None
+
+        model_files.append((path, stat.st_mtime_ns, stat.st_size))
+
+    return tuple(model_files)
+
+
+def _read_config(
+    model_files: tuple[tuple[str, int, int], ...],
+) -> dict[str, dict[str, Callable[[str, bool], tuple[str, bool]]]]:
+    config = {
+        "ProjektAnkiCloze": {
+            "Text": FORMATTERS["html"],
+            "Extra": FORMATTERS["html"],
+            "Bild": FORMATTERS["html"],
+            "Eigene Notizen & Bilder": FORMATTERS["clear"],
+            "Eigene Prüfungsfragen": FORMATTERS["clear"],
+            "Definitionen": FORMATTERS["html"],
+            "Merksprüche": FORMATTERS["html"],
+            "Klinik": FORMATTERS["html"],
+            "Präparat": FORMATTERS["html"],
+            "Memes": FORMATTERS["html"],
+            "Meditricks": FORMATTERS["meditricks"],
+            "AMBOSS-Link": FORMATTERS["plaintext"],
+            "Thieme via medici-Link": FORMATTERS["plaintext"],
+            "weitere Links": FORMATTERS["links"],
+            "Quelle": FORMATTERS["source"],
+            "Datum": FORMATTERS["date"],
+            "One by one": FORMATTERS["plaintext"],  # TODO
+            "Note ID": FORMATTERS["plaintext"],  # TODO
+            "ankihub_id": FORMATTERS["plaintext"],  # TODO
+        },
+    }
+
+    # validate all files before using any of them
+    models = []
+    for path, _, _ in model_files:
+        with open(path, encoding="utf-8") as f:
+            try:
+                models.append((path, _validate(json.load(f), path)))
+            except json.JSONDecodeError as e:
+                raise ConfigError(f"{path}: {e}") from e
+
+    for path, data in models:
+        config[data["name"]] = {
+            field["name"]: _field_formatter(field, path) for field in data["fields"]
+        }
+
+    return config
+
+
+def load_config(directory: str, note_types: list[NotetypeDict]) -> Plan:
+    # the model files are only read again once one of them was added, removed or modified
+    model_files = _model_files(directory)
+    if directory not in _CONFIGS or _CONFIGS[directory][0] != model_files:
+        _CONFIGS[directory] = (model_files, _read_config(model_files))
+        for plan_key in [plan_key for plan_key in _PLANS if plan_key[0] == directory]:
+            del _PLANS[plan_key]
+
+    plan_key = (directory, tuple(note_type["id"] for note_type in note_types))
+    key = tuple((note_type["mod"], note_type["name"]) for note_type in note_types)
+    if plan_key not in _PLANS or _PLANS[plan_key][0] != key:
+        _PLANS[plan_key] = (key, _compile_plan(_CONFIGS[directory][1], note_types))
+
+    return _PLANS[plan_key][1]
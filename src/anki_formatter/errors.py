@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from typing import NamedTuple
+
+from anki_formatter.formatters.common import InvalidValueError
+
+
+class FieldError(NamedTuple):
+    note_id: int
+    field: str
+    formatter: str
+    message: str
+
+
+def error_message(exception: Exception) -> str:
+    # invalid values are described by the formatter, anything else is unexpected
+    if isinstance(exception, InvalidValueError):
+        return str(exception)
+
+    return (
+        f"{type(exception).__name__}: {exception}" if str(exception) else type(exception).__name__
+    )
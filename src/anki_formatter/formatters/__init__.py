@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from collections.abc import Callable
+from functools import partial
 
 from anki_formatter.formatters.clear import clear
 from anki_formatter.formatters.date import format_date
@@ -25,3 +26,59 @@ FORMATTERS: dict[str, Callable[[str, bool], tuple[str, bool]]] = {
     "meditricks": format_meditricks,
     "links": format_links,
 }
+
+# bump the version of a formatter whenever its output changes, this invalidates cached results
+VERSIONS: dict[str, int] = {
+    "clear": 1,
+    "plaintext": 1,
+    "html": 2,
+    "skip": 1,
+    "occlusion": 1,
+    "imageOcclusionSVG": 1,
+    "source": 1,
+    "date": 1,
+    "meditricks": 1,
+    "links": 1,
+}
+
+# formatters without side effects (network, media files), safe to run in worker processes
+PURE_FORMATTERS: set[Callable[[str, bool], tuple[str, bool]]] = {
+    clear,
+    convert_to_plaintext,
+    format_html,
+    skip,
+    format_occlusion,
+    format_source,
+    format_date,
+    format_meditricks,
+}
+
+
+def is_pure(formatter: Callable[[str, bool], tuple[str, bool]]) -> bool:
+    # formatters configured with a policy are partials of a pure formatter
+    return getattr(formatter, "func", formatter) in PURE_FORMATTERS
+
+
+# formatters that read and write the files in the media folder of the collection
+MEDIA_FORMATTERS: set[Callable[..., tuple[str, bool]]] = {
+    format_image_occlusion_field,
+}
+
+
+def with_media_directory(
+    formatter: Callable[..., tuple[str, bool]],
+    media_directory: str,
+) -> Callable[[str, bool], tuple[str, bool]]:
+    if getattr(formatter, "func", formatter) not in MEDIA_FORMATTERS:
+        return formatter
+
+    return partial(formatter, media_directory=media_directory)
+
+
+# variants of formatters with side effects that do not write any files
+READ_ONLY_FORMATTERS: dict[
+    Callable[[str, bool], tuple[str, bool]],
+    Callable[[str, bool], tuple[str, bool]],
+] = {
+    format_image_occlusion_field: partial(format_image_occlusion_field, write_media=False),
+}
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import re
 from collections.abc import Generator
+from importlib.util import find_spec
 
 import requests
 from bs4 import BeautifulSoup
@@ -9,6 +10,15 @@ from bs4 import Comment
 from bs4 import NavigableString
 from bs4 import Tag
 
+# fields are small and their output must not depend on the installed packages, whole web pages are
+# parsed faster by lxml if it is installed
+FIELD_PARSER = "html.parser"
+DOCUMENT_PARSER = "lxml" if find_spec("lxml") else "html.parser"
+
+
+class InvalidValueError(ValueError):
+    pass
+
 
 def _extract_mathjax(text: str) -> list[tuple[str, bool]]:
     segments = []
@@ -185,7 +195,7 @@ def get_website_title(url: str) -> str:
     response = requests.get(url, timeout=5)
     response.raise_for_status()
 
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = BeautifulSoup(response.text, DOCUMENT_PARSER)
 
     title_tag = soup.find("title")
     assert isinstance(title_tag, Tag)
@@ -1,15 +1,12 @@
 from __future__ import annotations
 
-import sys
 from contextlib import suppress
 from datetime import datetime
 
 from anki_formatter.formatters.common import fix_encoding
+from anki_formatter.formatters.common import InvalidValueError
 from anki_formatter.formatters.common import replace_symbols
 
-if "pytest" not in sys.modules:  # pragma: no cover
-    from aqt.utils import showCritical
-
 
 def format_date(value: str, minimized: bool) -> tuple[str, bool]:
     formatted_value = fix_encoding(value)
@@ -24,6 +21,5 @@ def format_date(value: str, minimized: bool) -> tuple[str, bool]:
             parsed_date = datetime.strptime(formatted_value, fmt)
             formatted_value = parsed_date.strftime("%m/%Y")
             return formatted_value, value != formatted_value
-    else:  # pragma: no cover
-        showCritical(f"Unknown date format: {value}")
-        return value, False
+    else:
+        raise InvalidValueError(f"Unknown date format: {value}")
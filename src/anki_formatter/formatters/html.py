@@ -1,17 +1,20 @@
 from __future__ import annotations
 
 import re
-import warnings
+from collections.abc import Mapping
+from contextlib import suppress
+from functools import lru_cache
 from html import escape
+from html.entities import html5
 from html.parser import HTMLParser as PythonHTMLParser
-from itertools import product
+from types import MappingProxyType
 from typing import Literal
-
-from bs4 import BeautifulSoup
+from typing import NamedTuple
+from typing import TypeGuard
+from typing import Union
 
 from anki_formatter.formatters.common import fix_encoding
 from anki_formatter.formatters.common import replace_symbols
-from anki_formatter.formatters.common import strip_whitespace_between_tags
 
 ALLOWED_TAGS = {
     "section",
@@ -54,161 +57,743 @@ EMPTY_TAGS = {
     "td",
 }
 
+RENAMED_TAGS = {
+    "strong": "b",
+    "em": "i",
+}
 
-def _preserve_whitespace(text: str) -> str:
-    text = text.replace("&nbsp;", " ")
+# tags without content or end tag
+VOID_TAGS = {
+    "area",
+    "base",
+    "basefont",
+    "bgsound",
+    "br",
+    "col",
+    "command",
+    "embed",
+    "frame",
+    "hr",
+    "image",
+    "img",
+    "input",
+    "isindex",
+    "keygen",
+    "link",
+    "menuitem",
+    "meta",
+    "nextid",
+    "param",
+    "source",
+    "spacer",
+    "track",
+    "wbr",
+}
 
-    # move whitespace out of tag
-    for tag in FORMATTING_TAGS:
-        text = text.replace(f" </{tag}>", f"</{tag}> ")
-        text = text.replace(f"<{tag}> ", f" <{tag}>")
+PRESERVE_WHITESPACE_TAGS = {
+    "pre",
+    "textarea",
+}
 
-    # preserve whitespace before and after formatting-tags
-    for tag_1, tag_2 in product(FORMATTING_TAGS, repeat=2):
-        text = re.sub(rf"</{tag_1}>(?: \n*)+<{tag_2}>", f"</{tag_1}>☰<{tag_2}>", text)
-    for tag in FORMATTING_TAGS:
-        text = text.replace(f"</{tag}> ", f"</{tag}>☷")
-        text = text.replace(f" <{tag}>", f"☷<{tag}>")
+ASCII_SPACES = " \n\t\x0c\r"
+
+# whitespace next to formatting tags, these noncharacters are removed from the input, so the
+# markers are never mistaken for text
+WEAK_SPACE = "\ufdd0"  # stripped at the end of a line
+STRONG_SPACE = "\ufdd1"  # between two formatting tags, never stripped
+
+_FORMATTING_TAG = "|".join(sorted(FORMATTING_TAGS))
+_MARKER = f"{WEAK_SPACE}{STRONG_SPACE}"
+
+# everything postprocess changes: runs of formatting tags, spaces and whitespace markers, multiple
+# spaces between words and tags, and br at the end of li-items
+POSTPROCESS_PATTERN = re.compile(
+    rf"(?=[ <{_MARKER}])(?:"
+    rf"(?P<run>(?:(?<! ) *(?:[{_MARKER}]|</(?:{_FORMATTING_TAG})>)|<(?:{_FORMATTING_TAG})>)"
+    rf"(?: *(?:</?(?:{_FORMATTING_TAG})>|[{_MARKER}]))* *)"
+    rf"|(?P<spaces>(?<=\S) {{2,}}(?=\S))"
+    rf"|(?P<br>(?:<br>[\s{_MARKER}]*)+</li>)"
+    ")"
+)
+POSTPROCESS_TOKEN_PATTERN = re.compile(rf"</?[^>]+>| +|[{_MARKER}]")
+
+# text that fix_encoding, _remove_markers, replace_symbols or charrefs would change
+CLEAN_REJECT_PATTERN = re.compile(
+    "[&\ufeff\u00ad\xa0\ufdd0\ufdd1“”„‟⁺⁻⁰¹²³⁴⁵⁶⁷⁸⁹₊₋₀₁₂₃₄₅₆₇₈₉ᵢ\ud800-\udfff]|[-=]>"
+)
+CLEAN_TOKEN_PATTERN = re.compile(r'<(/?)([a-z-]+)((?: [a-z-]+="[^"<>\n]*")*)>|([^<]+)')
+CLEAN_ATTR_PATTERN = re.compile(r' ([a-z-]+)="([^"]*)"')
+
+# text without these characters has no markup, not even after the symbols are replaced by tags
+MARKUP_PATTERN = re.compile("[<&⁺⁻⁰¹²³⁴⁵⁶⁷⁸⁹₊₋₀₁₂₃₄₅₆₇₈₉ᵢ]")
+
+
+StyleRules = tuple[tuple[str, Union[tuple[str, ...], Literal["*"]]], ...]
+RequiredAttrValue = Union[str, tuple[tuple[str, str], ...]]
+
+
+class HTMLPolicy(NamedTuple):
+    # which tags and attrs a field keeps, it is sent to the workers and compiled once per process
+    tags: tuple[str, ...]  # all other tags will be removed
+    empty_tags: tuple[str, ...]  # these tags will be kept without content
+    attrs: tuple[tuple[str, str, StyleRules | None], ...]  # all other attrs will be removed
+    required_attrs: tuple[tuple[str, str, RequiredAttrValue], ...]  # these attrs will always be set
+
+
+POLICY = HTMLPolicy(
+    tags=tuple(sorted(ALLOWED_TAGS)),
+    empty_tags=tuple(sorted(EMPTY_TAGS)),
+    attrs=(
+        ("col", "style", (("width", "*"),)),
+        ("img", "src", None),
+        ("ol", "start", None),
+        ("td", "colspan", None),
+        ("td", "rowspan", None),
+        ("td", "style", (("text-align", ("center", "right")), ("white-space", ("nowrap",)))),
+    ),
+    required_attrs=(
+        ("table", "border", "1"),
+        ("table", "style", (("border-collapse", "collapse"),)),
+    ),
+)
+
+
+class HTMLRules(NamedTuple):
+    allowed_tags: frozenset[str]  # all other tags will be removed
+    empty_tags: frozenset[str]  # these tags will be kept without content
+    indent: int
+    no_break_tags: frozenset[str]  # inside these tags, there will be no line break
+    no_whitespace_before: tuple[str, ...]  # whitespace infront of these strings will be removed
+    no_whitespace_after: tuple[str, ...]  # whitespace after of these strings will be removed
+    allowed_attrs: Mapping[
+        tuple[str, str], None | Mapping[str, frozenset[str] | Literal["*"]]
+    ]  # all other attrs will be removed
+    required_attrs: Mapping[str, tuple[str, ...]]  # these attrs will always be set
+    rstrip_chars: str  # these characters will be treated as whitespace and stripped if needed
+    block_tag_at_end: re.Pattern[str]  # lines ending with these tags will be broken
+
+
+def _allowed_attrs(
+    allowed_attrs: tuple[tuple[str, str, StyleRules | None], ...],
+) -> Mapping[tuple[str, str], None | Mapping[str, frozenset[str] | Literal["*"]]]:
+    attrs: dict[tuple[str, str], None | Mapping[str, frozenset[str] | Literal["*"]]] = {}
+
+    for tag, attr_key, style_rules in allowed_attrs:
+        if style_rules is None:
+            attrs[(tag, attr_key)] = None
+        else:
+            attrs[(tag, attr_key)] = MappingProxyType(
+                {key: values if values == "*" else frozenset(values) for key, values in style_rules}
+            )
+
+    return MappingProxyType(attrs)
+
+
+def _required_attrs(
+    required_attrs: tuple[tuple[str, str, RequiredAttrValue], ...],
+) -> Mapping[str, tuple[str, ...]]:
+    attrs: dict[str, tuple[str, ...]] = {}
+
+    for tag, attr_key, attr_value in required_attrs:
+        if not isinstance(attr_value, str) and attr_key == "style":
+            attr_value = f'{"; ".join(f"{k}: {v}" for k, v in attr_value)};'
+        elif not isinstance(attr_value, str):  # pragma: no cover
+            raise ValueError
+
+        attrs[tag] = attrs.get(tag, ()) + (f'{attr_key}="{escape(attr_value)}"',)
+
+    return MappingProxyType(attrs)
+
+
+@lru_cache(maxsize=None)
+def _rules(policy: HTMLPolicy) -> HTMLRules:
+    inline_tags = FORMATTING_TAGS | {
+        "anki-mathjax",
+    }  # these tags will be placed on the current line
+    # the layout is the same for all policies, tags that are not allowed are never emitted
+    block_tags = ALLOWED_TAGS - inline_tags
+
+    return HTMLRules(
+        allowed_tags=frozenset(policy.tags),
+        empty_tags=frozenset(policy.empty_tags),
+        indent=2,
+        no_break_tags=frozenset(
+            inline_tags
+            | {
+                "li",
+                "caption",
+                "td",
+            }
+        ),
+        no_whitespace_before=(
+            ".",
+            ",",
+            "!",
+            "?",
+            ":",
+            "}}",
+            "::",
+            WEAK_SPACE,
+            STRONG_SPACE,
+        ),
+        no_whitespace_after=(
+            "{{",
+            "::",
+            WEAK_SPACE,
+            STRONG_SPACE,
+        ),
+        allowed_attrs=_allowed_attrs(policy.attrs),
+        required_attrs=_required_attrs(policy.required_attrs),
+        rstrip_chars=" " + WEAK_SPACE,
+        block_tag_at_end=re.compile(rf"({'|'.join(sorted(block_tags))})\s*[^>]*?>$"),
+    )
 
-    # merge preserved whitspace
-    text = re.sub(r"☷+", "☷", text)
-    text = re.sub(r"[☷☰]+", lambda m: "☰" if "☰" in m.group() else m.group(), text)
 
-    return text
+RULES = _rules(POLICY)
 
 
-def preprocess(text: str) -> str:
-    text = fix_encoding(text)
-    text = replace_symbols(text, html=True, tags_only=True)
+def _is_str_list(value: object) -> TypeGuard[list[str]]:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def _policy_tags(value: object, key: str) -> tuple[str, ...]:
+    if not _is_str_list(value):
+        raise ValueError(f'"{key}" must be a list of tags')
+
+    if unknown := sorted(set(value) - ALLOWED_TAGS):
+        raise ValueError(f'"{key}" contains the unsupported tags {", ".join(unknown)}')
+
+    return tuple(sorted(set(value)))
+
+
+def _policy_attrs(value: object) -> tuple[tuple[str, str, StyleRules | None], ...]:
+    if not isinstance(value, dict) or not all(isinstance(attrs, dict) for attrs in value.values()):
+        raise ValueError('"attrs" must map tags to their attrs')
+
+    attrs: list[tuple[str, str, StyleRules | None]] = []
+    for tag, tag_attrs in sorted(value.items()):
+        for attr_key, rules in sorted(tag_attrs.items()):
+            if rules == "*":
+                attrs.append((tag, attr_key, None))
+            elif (
+                attr_key == "style"
+                and isinstance(rules, dict)
+                and all(values == "*" or _is_str_list(values) for values in rules.values())
+            ):
+                style_rules: StyleRules = tuple(
+                    (key, "*" if values == "*" else tuple(sorted(set(values))))
+                    for key, values in sorted(rules.items())
+                )
+                attrs.append((tag, attr_key, style_rules))
+            else:
+                raise ValueError(
+                    f'attr "{attr_key}" of "{tag}" must be "*" or map style properties to "*" '
+                    "or a list of values"
+                )
+
+    return tuple(attrs)
+
+
+def _policy_required_attrs(value: object) -> tuple[tuple[str, str, RequiredAttrValue], ...]:
+    if not isinstance(value, dict) or not all(isinstance(attrs, dict) for attrs in value.values()):
+        raise ValueError('"requiredAttrs" must map tags to their attrs')
+
+    # the attrs are set in the given order
+    required_attrs: list[tuple[str, str, RequiredAttrValue]] = []
+    for tag, tag_attrs in value.items():
+        for attr_key, attr_value in tag_attrs.items():
+            if isinstance(attr_value, str):
+                required_attrs.append((tag, attr_key, attr_value))
+            elif (
+                attr_key == "style"
+                and isinstance(attr_value, dict)
+                and all(isinstance(item, str) for item in attr_value.values())
+            ):
+                required_attrs.append((tag, attr_key, tuple(attr_value.items())))
+            else:
+                raise ValueError(
+                    f'required attr "{attr_key}" of "{tag}" must be a string or map style '
+                    "properties to strings"
+                )
+
+    return tuple(required_attrs)
+
+
+def html_policy(data: Mapping[str, object]) -> HTMLPolicy:
+    # the policy of a field in model.json, keys that are not given keep the default
+    if unknown := sorted(set(data) - {"tags", "emptyTags", "attrs", "requiredAttrs"}):
+        raise ValueError(f'unknown keys {", ".join(unknown)}')
+
+    return HTMLPolicy(
+        tags=_policy_tags(data["tags"], "tags") if "tags" in data else POLICY.tags,
+        empty_tags=(
+            _policy_tags(data["emptyTags"], "emptyTags")
+            if "emptyTags" in data
+            else POLICY.empty_tags
+        ),
+        attrs=_policy_attrs(data["attrs"]) if "attrs" in data else POLICY.attrs,
+        required_attrs=(
+            _policy_required_attrs(data["requiredAttrs"])
+            if "requiredAttrs" in data
+            else POLICY.required_attrs
+        ),
+    )
+
+
+class Element:
+    __slots__ = ("name", "attrs", "children")
+
+    def __init__(self, name: str, attrs: dict[str, str]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.children: list[Element | str] = []
+
+
+class Markup(str):
+    # comments, declarations and processing instructions, they are never emitted
+    pass
+
+
+class StartTag(NamedTuple):
+    name: str
+    attrs: dict[str, str]
+    closed: bool
+
+
+class EndTag(NamedTuple):
+    name: str
+
+
+Token = Union[StartTag, EndTag, str]
+
+
+class Tokenizer(PythonHTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=False)
+
+        self.tokens: list[Token] = []
+
+        self.__data: list[str] = []
+        self.__closed_void_tags: list[str] = []
+
+    def __end_data(self) -> None:
+        if self.__data:
+            self.tokens.append("".join(self.__data))
+            self.__data = []
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        self.__end_data()
+        self.tokens.append(StartTag(tag, _attrs_dict(attrs), True))
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        self.__end_data()
+        self.tokens.append(StartTag(tag, _attrs_dict(attrs), tag in VOID_TAGS))
+
+        if tag in VOID_TAGS:
+            self.__closed_void_tags.append(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        # end tag of a void tag that was already closed, it does not interrupt the text
+        if tag in self.__closed_void_tags:
+            self.__closed_void_tags.remove(tag)
+            return
+
+        self.__end_data()
+        self.tokens.append(EndTag(tag))
+
+    def handle_data(self, data: str) -> None:
+        self.__data.append(data)
+
+    def handle_charref(self, name: str) -> None:
+        self.__data.append(_charref(name))
+
+    def handle_entityref(self, name: str) -> None:
+        # unknown entities are kept as text
+        self.__data.append(html5.get(f"{name};", f"&{name}"))
+
+    def __handle_markup(self, data: str) -> None:
+        self.__end_data()
+        self.tokens.append(Markup(data))
+
+    def handle_comment(self, data: str) -> None:
+        self.__handle_markup(data)
+
+    def handle_decl(self, decl: str) -> None:
+        # without the leading "DOCTYPE "
+        self.__handle_markup(decl[8:])
+
+    def unknown_decl(self, data: str) -> None:
+        # without the leading "CDATA["
+        if data.upper().startswith("CDATA["):
+            data = data[6:]
+
+        self.__handle_markup(data)
+
+    def handle_pi(self, data: str) -> None:
+        self.__handle_markup(data)
+
+    def close(self) -> None:
+        super().close()
+        self.__end_data()
+
+
+def _is_text(token: Token | Element | None) -> TypeGuard[str]:
+    return isinstance(token, str) and not isinstance(token, Markup)
+
+
+def _is_formatting_start(token: Token | None) -> bool:
+    return isinstance(token, StartTag) and not token.closed and token.name in FORMATTING_TAGS
+
+
+def _is_formatting_end(token: Token | None) -> bool:
+    return isinstance(token, EndTag) and token.name in FORMATTING_TAGS
+
+
+def _encloses(start: Token | None, end: Token | None) -> bool:
+    return (
+        _is_formatting_start(start)
+        and isinstance(start, StartTag)
+        and isinstance(end, EndTag)
+        and end.name == start.name
+    )
+
+
+def _preserve_whitespace(tokens: list[Token]) -> list[Token]:
+    # every tag gets the (possibly empty) text before and after it
+    texts = [""]
+    tags: list[Token | None] = [None]
+    for token in tokens:
+        if _is_text(token):
+            texts[-1] = token
+        else:
+            texts.append("")
+            tags.append(token)
+    tags.append(None)
+
+    # whether the text is preceded by a formatting end tag or followed by a formatting start tag
+    after_end = [_is_formatting_end(tag) for tag in tags[:-1]]
+    before_start = [_is_formatting_start(tag) for tag in tags[1:]]
+
+    # a space at the inner side of a formatting tag is moved out of the tag, the only space of an
+    # element is moved out of its end tag
+    moved_left = [False] * len(texts)
+    moved_right = [False] * len(texts)
+    for index, text in enumerate(texts):
+        if not text:
+            continue
+        if text == " " and _encloses(tags[index], tags[index + 1]):
+            texts[index] = ""
+            moved_right[index] = True
+            continue
+        if index and before_start[index - 1] and text.startswith(" "):
+            text = text[1:]
+            moved_left[index] = True
+        if index < len(texts) - 1 and after_end[index + 1] and text.endswith(" "):
+            text = text[:-1]
+            moved_right[index] = True
+        texts[index] = text
+
+    preserved: list[Token] = []
+    for index, text in enumerate(texts):
+        tag_after = tags[index + 1]
+
+        if index and moved_right[index - 1]:
+            text = f" {text}"
+        if index < len(texts) - 1 and moved_left[index + 1]:
+            text = f"{text} "
+
+        # preserve whitespace before and after formatting tags
+        if text.startswith(" ") or text.endswith(" "):
+            if (
+                after_end[index]
+                and before_start[index]
+                and text.startswith(" ")
+                and not text.strip(" \n")
+            ):
+                text = STRONG_SPACE
+            else:
+                if after_end[index] and text.startswith(" "):
+                    text = f"{WEAK_SPACE}{text[1:]}"
+                if before_start[index] and text.endswith(" "):
+                    text = f"{text[:-1]}{WEAK_SPACE}"
+
+        if text:
+            preserved.append(text)
+        if tag_after is not None:
+            preserved.append(tag_after)
+
+    return preserved
+
+
+def _build_tree(tokens: list[Token]) -> Element:
+    # builds the same tree as BeautifulSoup's html.parser tree builder
+    root = Element("", {})
+
+    stack = [root]
+    open_tags: dict[str, int] = {}
+    preserve_whitespace = 0
+
+    for token in tokens:
+        if isinstance(token, StartTag):
+            element = Element(token.name, token.attrs)
+            stack[-1].children.append(element)
+
+            if not token.closed:
+                stack.append(element)
+                open_tags[token.name] = open_tags.get(token.name, 0) + 1
+                preserve_whitespace += token.name in PRESERVE_WHITESPACE_TAGS
+        elif isinstance(token, EndTag):
+            # close the most recent open tag with this name, ignore stray end tags
+            if open_tags.get(token.name):
+                while True:
+                    name = stack.pop().name
+                    open_tags[name] -= 1
+                    preserve_whitespace -= name in PRESERVE_WHITESPACE_TAGS
+                    if name == token.name:
+                        break
+        else:
+            if not preserve_whitespace and not token.strip(ASCII_SPACES):
+                token = type(token)("\n" if "\n" in token else " ")
 
-    text = _preserve_whitespace(text)
+            stack[-1].children.append(token)
 
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        soup = BeautifulSoup(text, "html.parser")
+    return root
 
-    # use formatting tags
-    for tag in soup.find_all("strong"):
-        tag.name = "b"
-    for tag in soup.find_all("em"):
-        tag.name = "i"
 
-    # merge redundant tags
-    for tag in FORMATTING_TAGS:
-        for outer_tag in soup.find_all(tag):
-            nested_tags = outer_tag.find_all(tag, recursive=False)
-            for nested in nested_tags:
-                nested.unwrap()
+def _charref(name: str) -> str:
+    number = int(name[1:], 16) if name.startswith(("x", "X")) else int(name)
+
+    if number == 0 or number > 0x10FFFF or 0xD800 <= number <= 0xDFFF:
+        return "\ufffd"
+
+    if 0x80 <= number <= 0x9F:
+        with suppress(UnicodeDecodeError):
+            return bytes([number]).decode("cp1252")
+
+    return _remove_markers(chr(number))
+
+
+def _remove_markers(text: str) -> str:
+    return text.replace(WEAK_SPACE, "").replace(STRONG_SPACE, "")
+
+
+def _attrs_dict(attrs: list[tuple[str, str | None]]) -> dict[str, str]:
+    # the last value of a duplicate attribute wins
+    attrs_dict: dict[str, str] = {}
+    for key, value in attrs:
+        attrs_dict[key] = value or ""
+
+    return attrs_dict
+
+
+def _clean_tree(element: Element, rules: HTMLRules) -> tuple[list[Element | str], bool]:
+    # returns the nodes that replace the element and whether it had content before empty tags
+    # were removed
+    children = element.children
+
+    # merge redundant tags, only direct children are merged into their parent
+    if element.name in FORMATTING_TAGS:
+        children = []
+        for child in element.children:
+            if isinstance(child, Element):
+                child.name = RENAMED_TAGS.get(child.name, child.name)
+                if child.name == element.name:
+                    children += child.children
+                    continue
+            children.append(child)
+
+    cleaned: list[Element | str] = []
+    has_content = False
+
+    for child in children:
+        if isinstance(child, Element):
+            # use formatting tags
+            child.name = RENAMED_TAGS.get(child.name, child.name)
+            nodes, child_has_content = _clean_tree(child, rules)
+        else:
+            nodes, child_has_content = [child], child != "\n"
+
+        has_content = has_content or child_has_content
+
+        for node in nodes:
+            if cleaned and _is_text(cleaned[-1]) and _is_text(node):
+                node = f"{cleaned.pop()}{node}"
+            cleaned.append(node)
 
     # remove unwanted tags
-    for tag in soup.find_all():
-        if tag.name not in ALLOWED_TAGS:
-            tag.unwrap()
+    if element.name not in rules.allowed_tags:
+        return cleaned, has_content
+
+    element.children = cleaned
 
     # remove empty tags
-    for tag in soup.find_all():
-        if (
-            len(tag.get_text(strip=True)) == 0
-            and len([content for content in tag.contents if content != "\n"]) == 0
-            and tag.name not in EMPTY_TAGS
-        ):
-            tag.extract()
+    if element.name not in rules.empty_tags and not has_content:
+        return [], True
+
+    return [element], True
+
 
-    soup.smooth()
-    text = soup.prettify()
+def preprocess(text: str, rules: HTMLRules = RULES) -> Element:
+    text = _remove_markers(fix_encoding(text))
+    text = replace_symbols(text, html=True, tags_only=True)
 
-    text = strip_whitespace_between_tags(text)
-    text = text.replace("\n", " ")
-    text = text.strip()
+    text = text.replace("&nbsp;", " ")
 
-    return text
+    tokenizer = Tokenizer()
+    tokenizer.feed(text)
+    tokenizer.close()
 
+    root = _build_tree(_preserve_whitespace(tokenizer.tokens))
 
-def postprocess(text: str) -> str:
-    # remove unwanted whitespace between and after formatting-tags and merge them
-    for tag in FORMATTING_TAGS:
-        text = re.sub(f"</{tag}>(?: )*<{tag}>", "", text)
-        text = re.sub(rf"</{tag}> *", f"</{tag}>", text)
+    root.children, _ = _clean_tree(root, rules)
+
+    return root
+
+
+def _is_clean(tokens: list[Token], rules: HTMLRules) -> bool:
+    # whether the tokens build a tree of allowed tags that _clean_tree would not change
+    stack: list[str] = []
+    has_content = [False]
+
+    for token in tokens:
+        if isinstance(token, StartTag):
+            if token.name in FORMATTING_TAGS and stack and stack[-1] == token.name:
+                return False
+
+            has_content[-1] = True
+            if not token.closed:
+                stack.append(token.name)
+                has_content.append(False)
+        elif isinstance(token, EndTag):
+            if not stack or stack.pop() != token.name:
+                return False
+
+            if not has_content.pop() and token.name not in rules.empty_tags:
+                return False
+        elif token.strip(ASCII_SPACES) or "\n" not in token:
+            has_content[-1] = True
+
+    return not stack
+
+
+def _clean_tokens(text: str, rules: HTMLRules) -> list[Token] | None:
+    # the tokens of text if they can be emitted without preprocess, None if text needs to be
+    # preprocessed
+    if CLEAN_REJECT_PATTERN.search(text):
+        return None
+
+    tokens: list[Token] = []
+    position = 0
+
+    for match in CLEAN_TOKEN_PATTERN.finditer(text):
+        if match.start() != position:
+            return None
+        position = match.end()
+
+        end, name, attrs, data = match.groups()
+
+        if data is not None:
+            tokens.append(data)
+        elif name not in rules.allowed_tags:
+            return None
+        elif end:
+            if attrs or name in VOID_TAGS:
+                return None
+            tokens.append(EndTag(name))
+        else:
+            attrs_dict = _attrs_dict(CLEAN_ATTR_PATTERN.findall(attrs))
+            tokens.append(StartTag(name, attrs_dict, name in VOID_TAGS))
+
+    if position != len(text):
+        return None
+
+    tokens = _preserve_whitespace(tokens)
+
+    return tokens if _is_clean(tokens, rules) else None
 
-    # undo preserve whitespace
-    text = text.replace("☰", " ")
-    text = text.replace("☷", " ")
 
-    # collapse multiple spaces between words and tags
-    text = re.sub(r"(?<=\S) +(?=\S)", " ", text)
-    text = re.sub(r"(?<=>) +(?=\S)", " ", text)
-    text = re.sub(r"(?<=\S) +(?=<)", " ", text)
-    text = re.sub(r"(?<=>) +(?=<)", " ", text)
+@lru_cache(maxsize=4096)
+def _postprocess_run(run: str, bounded_before: bool, bounded_after: bool) -> str:
+    # remove whitespace after formatting-tags and merge them
+    tokens: list[str] = []
+    for token in POSTPROCESS_TOKEN_PATTERN.findall(run):
+        if tokens and tokens[-1].startswith("</"):
+            if token[0] == " ":
+                continue
+            if tokens[-1] == f"</{token[1:]}":
+                tokens.pop()
+                continue
+        tokens.append(token)
 
-    # remove br at end of li-items
-    text = re.sub(r"(?:<br>\s*)+</li>", "</li>", text)
+    # undo preserve whitespace, collapse multiple spaces and combine formatting tags
+    normalized: list[str] = []
+    spaces = 0
+    for token in tokens:
+        if token[0] != "<":
+            spaces += len(token)
+            continue
 
-    # combine formatting tags
-    for tag in FORMATTING_TAGS:
-        text = re.sub(f"</{tag}>( *)<{tag}>", r"\1", text)
+        if spaces:
+            normalized.append(" " if bounded_before else " " * spaces)
+            spaces = 0
+        bounded_before = True
 
-    text = text.rstrip()
+        if token[1] != "/":
+            index = len(normalized) - 1
+            while index >= 0 and normalized[index][0] == " ":
+                index -= 1
+            if index >= 0 and normalized[index] == f"</{token[1:]}":
+                del normalized[index]
+                continue
 
-    return text
+        normalized.append(token)
+
+    if spaces:
+        normalized.append(" " if bounded_before and bounded_after else " " * spaces)
+
+    return "".join(normalized)
+
+
+def _postprocess_match(match: re.Match[str]) -> str:
+    if match.lastgroup == "br":
+        # remove br at end of li-items
+        return "</li>"
+
+    if match.lastgroup == "spaces":
+        # collapse multiple spaces between words and tags
+        return " "
+
+    text = match.string
+    start, end = match.span()
+
+    return _postprocess_run(
+        match[0],
+        start > 0 and not text[start - 1].isspace(),
+        end < len(text) and not text[end].isspace(),
+    )
+
+
+def postprocess(text: str) -> str:
+    return POSTPROCESS_PATTERN.sub(_postprocess_match, text).rstrip()
+
+
+def postprocess_minimized(lines: list[str]) -> str:
+    # postprocess never changes anything across line breaks, minimizing removes them together with
+    # the spaces at the start of the next line
+    lines = [POSTPROCESS_PATTERN.sub(_postprocess_match, line) for line in lines]
+
+    return "".join([*lines[:1], *(line.lstrip(" ") for line in lines[1:])]).rstrip()
 
 
 class HTMLParser(PythonHTMLParser):
-    def __init__(self) -> None:
+    def __init__(self, rules: HTMLRules = RULES, minimized: bool = False) -> None:
+        self.__rules = rules
+        self.__indent_width = 0 if minimized else rules.indent
+
         super().__init__()
 
-        self.INDENT = 2
-        self.ALLOWED_TAGS = ALLOWED_TAGS  # all other tags will be removed
-        self.INLINE_TAGS = FORMATTING_TAGS | {
-            "anki-mathjax",
-        }  # these tags will be placed on the current line
-        self.NO_BREAK_TAGS = self.INLINE_TAGS | {
-            "li",
-            "caption",
-            "td",
-        }  # inside these tags, there will be no line break
-
-        self.NO_WHITESPACE_BEFORE = {
-            ".",
-            ",",
-            "!",
-            "?",
-            ":",
-            "}}",
-            "::",
-            "☷",
-            "☰",
-        }  # whitespace infront of these strings will be removed
-        self.NO_WHITESPACE_AFTER = {
-            "{{",
-            "::",
-            "☷",
-            "☰",
-        }  # whitespace after of these strings will be removed
-
-        self.ALLOWED_ATTRS: dict[tuple[str, str], None | dict[str, set[str] | Literal["*"]]] = {
-            ("img", "src"): None,
-            ("ol", "start"): None,
-            ("col", "style"): {
-                "width": "*",
-            },
-            ("td", "rowspan"): None,
-            ("td", "colspan"): None,
-            ("td", "style"): {
-                "text-align": {"center", "right"},
-                "white-space": {"nowrap"},
-            },
-        }  # all other attrs will be removed
-
-        self.REQUIRED_ATTRS: dict[tuple[str, str], str | dict[str, str]] = {
-            ("table", "border"): "1",
-            ("table", "style"): {
-                "border-collapse": "collapse",
-            },
-        }  # these attrs will always be set
-
-        self.RSTRIP_CHARS = (
-            " ☷"  # these characters will be treated as whitespace and stripped if needed
-        )
+    def reset(self) -> None:
+        super().reset()
 
         self.__indent_level = 0
         self.__line = ""
@@ -219,13 +804,14 @@ class HTMLParser(PythonHTMLParser):
     def __attrs_str(self, tag: str, attrs: list[tuple[str, str | None]]) -> str:
         attrs_list: list[str] = []
 
-        for attr_key, attr_value in attrs:
-            if (tag, attr_key) in self.ALLOWED_ATTRS and attr_value:
-                rules = self.ALLOWED_ATTRS[(tag, attr_key)]
+        # the kept attrs are sorted like bs4 sorts them, the required attrs keep their order
+        for attr_key, attr_value in sorted(attrs, key=lambda attr: attr[0]):
+            if (tag, attr_key) in self.__rules.allowed_attrs and attr_value:
+                rules = self.__rules.allowed_attrs[(tag, attr_key)]
 
                 if rules is None:
                     attrs_list.append(f'{attr_key}="{escape(attr_value)}"')
-                elif isinstance(rules, dict) and attr_key == "style":
+                elif isinstance(rules, Mapping) and attr_key == "style":
                     original_style = {
                         k.strip(): v.strip()
                         for item in attr_value.split(";")
@@ -244,16 +830,7 @@ class HTMLParser(PythonHTMLParser):
                 else:  # pragma: no cover
                     raise ValueError
 
-        for (tag_name, required_attr_key), required_attr_value in self.REQUIRED_ATTRS.items():
-            if tag_name == tag:
-                if isinstance(required_attr_value, str):
-                    attrs_list.append(f'{required_attr_key}="{escape(required_attr_value)}"')
-                elif isinstance(required_attr_value, dict) and required_attr_key == "style":
-                    attrs_list.append(
-                        f'{required_attr_key}="{escape("; ".join(f"{k}: {v}" for k, v in required_attr_value.items()))};"',  # noqa: E501
-                    )
-                else:  # pragma: no cover
-                    raise ValueError
+        attrs_list += self.__rules.required_attrs.get(tag, ())
 
         if attrs_list:
             return " " + " ".join(attrs_list)
@@ -262,27 +839,26 @@ class HTMLParser(PythonHTMLParser):
 
     @property
     def __indent(self) -> str:
-        return " " * self.INDENT * self.__indent_level
+        return " " * self.__indent_width * self.__indent_level
 
     @property
     def __stripped_line(self) -> str:
-        return self.__line.rstrip(self.RSTRIP_CHARS)
+        return self.__line.rstrip(self.__rules.rstrip_chars)
 
     @property
     def __break_line(self) -> bool:
         if not self.__line:
             return True
 
-        if self.__stripped_line.endswith("<br>"):
+        stripped_line = self.__stripped_line
+
+        if stripped_line.endswith("<br>"):
             return False
 
-        if self.__tag in self.NO_BREAK_TAGS:
+        if self.__tag in self.__rules.no_break_tags:
             return False
 
-        if re.search(
-            rf"({'|'.join(self.ALLOWED_TAGS - self.INLINE_TAGS)})\s*[^>]*?>$",
-            self.__stripped_line,
-        ):
+        if self.__rules.block_tag_at_end.search(stripped_line):
             return True
 
         return False
@@ -291,7 +867,7 @@ class HTMLParser(PythonHTMLParser):
         if self.__stripped_line.endswith(">"):
             return True
 
-        if self.__stripped_line.endswith(tuple(self.NO_WHITESPACE_AFTER)):
+        if self.__stripped_line.endswith(self.__rules.no_whitespace_after):
             return True
 
         if tag in {"sub", "sup"}:
@@ -315,7 +891,7 @@ class HTMLParser(PythonHTMLParser):
             # linebreak if current tag is breakable
 
             self.__append_to_stripped_line(f"<{tag}{self.__attrs_str(tag, attrs)}>")
-            if not (self.__tag_stack and self.__tag_stack[-1] in self.NO_BREAK_TAGS):
+            if not (self.__tag_stack and self.__tag_stack[-1] in self.__rules.no_break_tags):
                 self.__next_line()
         elif tag == "img":
             # place on new line
@@ -331,7 +907,7 @@ class HTMLParser(PythonHTMLParser):
             raise ValueError()
 
     def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
-        if tag in self.NO_BREAK_TAGS:
+        if tag in self.__rules.no_break_tags:
             if self.__break_line:
                 self.__next_line()
                 self.__append_to_line(f"{self.__indent}<{tag}{self.__attrs_str(tag, attrs)}>")
@@ -351,7 +927,7 @@ class HTMLParser(PythonHTMLParser):
         self.__tag_stack.append(tag)
 
     def handle_endtag(self, tag: str) -> None:
-        if tag in self.NO_BREAK_TAGS:
+        if tag in self.__rules.no_break_tags:
             if tag in ("sub", "sup"):
                 self.__append_to_stripped_line(f"</{tag}>")
             else:
@@ -367,39 +943,105 @@ class HTMLParser(PythonHTMLParser):
         self.__tag_stack.pop()
 
     def handle_data(self, data: str) -> None:
-        data = replace_symbols(data, html=True)
+        self.__append_data(replace_symbols(data, html=True))
 
-        if data.startswith(("☷", "☰")) and data[1:].startswith(tuple(self.NO_WHITESPACE_BEFORE)):
+    def __append_data(self, data: str) -> None:
+        if data.startswith((WEAK_SPACE, STRONG_SPACE)) and data[1:].startswith(
+            self.__rules.no_whitespace_before
+        ):
             data = data[1:]
 
-        if data.startswith(tuple(self.NO_WHITESPACE_BEFORE)):
-            self.__line = self.__line.rstrip(self.RSTRIP_CHARS)
+        if data.startswith(self.__rules.no_whitespace_before):
+            self.__line = self.__line.rstrip(self.__rules.rstrip_chars)
 
-        if not self.__tag or self.__tag in self.NO_BREAK_TAGS:
+        if not self.__tag or self.__tag in self.__rules.no_break_tags:
             if not self.__line:
-                self.__line += data.lstrip("☷☰")
+                self.__line += data.lstrip(WEAK_SPACE + STRONG_SPACE)
             else:
                 self.__line += data
         else:
             self.__next_line()
-            self.__line = f"{self.__indent}{data.lstrip('☷☰')}"
+            self.__line = f"{self.__indent}{data.lstrip(WEAK_SPACE + STRONG_SPACE)}"
+
+    def feed_tree(self, element: Element) -> None:
+        for child in element.children:
+            if isinstance(child, Markup):
+                continue
+            elif isinstance(child, str):
+                data = child.strip()
+                if data:
+                    self.handle_data(data.replace("\n", " "))
+            else:
+                attrs: list[tuple[str, str | None]] = [
+                    (key, value.replace("\n", " ")) for key, value in child.attrs.items()
+                ]
+                if child.name in VOID_TAGS:
+                    self.handle_startendtag(child.name, attrs)
+                else:
+                    self.handle_starttag(child.name, attrs)
+                    self.feed_tree(child)
+                    self.handle_endtag(child.name)
+
+    def feed_tokens(self, tokens: list[Token]) -> None:
+        # tokens of text that needs no preprocessing, see _clean_tokens
+        for token in tokens:
+            if isinstance(token, StartTag):
+                attrs: list[tuple[str, str | None]] = list(token.attrs.items())
+                if token.closed:
+                    self.handle_startendtag(token.name, attrs)
+                else:
+                    self.handle_starttag(token.name, attrs)
+            elif isinstance(token, EndTag):
+                self.handle_endtag(token.name)
+            else:
+                data = token.strip()
+                if data:
+                    self.__append_data(data.replace("\n", " "))
 
-    def get_parsed_string(self) -> str:
+    def get_parsed_lines(self) -> list[str]:
         self.__lines += [self.__line]
 
-        return "\n".join(line.rstrip(self.RSTRIP_CHARS) for line in self.__lines if line)
+        return [line.rstrip(self.__rules.rstrip_chars) for line in self.__lines if line]
+
+    def get_parsed_string(self) -> str:
+        return "\n".join(self.get_parsed_lines())
+
+
+def _format_text(text: str) -> str:
+    # same as emitting the tree of text without markup, which is a single line of text
+    text = _remove_markers(fix_encoding(text)).strip().replace("\n", " ")
+    text = replace_symbols(text, html=True)
 
+    return text.rstrip(RULES.rstrip_chars)
 
-def format_html(html: str, minimized: bool) -> tuple[str, bool]:
-    formatted_html = preprocess(html)
 
-    parser = HTMLParser()
-    parser.feed(formatted_html)
-    formatted_html = parser.get_parsed_string()
+# parsers of every policy and mode, they are reset and reused and every concurrent call takes its
+# own one
+_PARSERS: dict[tuple[HTMLPolicy, bool], list[HTMLParser]] = {}
 
-    formatted_html = postprocess(formatted_html)
+
+def format_html(html: str, minimized: bool, policy: HTMLPolicy = POLICY) -> tuple[str, bool]:
+    if not MARKUP_PATTERN.search(html):
+        lines = [_format_text(html)]
+    else:
+        rules = _rules(policy)
+        parsers = _PARSERS.setdefault((policy, minimized), [])
+        parser = parsers.pop() if parsers else HTMLParser(rules, minimized)
+        try:
+            # already formatted fields are usually clean and skip the tokenizer and the tree
+            tokens = _clean_tokens(html, rules)
+            if tokens is None:
+                parser.feed_tree(preprocess(html, rules))
+            else:
+                parser.feed_tokens(tokens)
+            lines = parser.get_parsed_lines()
+        finally:
+            parser.reset()
+            parsers.append(parser)
 
     if minimized:
-        formatted_html = re.sub(r"\n *", "", formatted_html)
+        formatted_html = postprocess_minimized(lines)
+    else:
+        formatted_html = postprocess("\n".join(lines))
 
     return formatted_html, html != formatted_html
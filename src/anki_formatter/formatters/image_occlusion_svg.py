@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 import os
 import re
 import sys
@@ -23,19 +24,33 @@ if "pytest" in sys.modules:  # pragma: no cover
     }
     sys.modules["aqt"] = aqt
 
-from aqt import mw
+try:
+    from aqt import mw
+except ImportError:  # pragma: no cover
+    # the command line and the benchmarks run without Anki's GUI
+    mw = None
+
 from bs4 import BeautifulSoup
 from bs4 import Comment
 from bs4 import Tag
 
 from anki_formatter.formatters.common import attrs
+from anki_formatter.formatters.common import FIELD_PARSER
 from anki_formatter.formatters.common import format_number
 from anki_formatter.formatters.common import get_child_tags
 from anki_formatter.formatters.common import get_classes
 from anki_formatter.formatters.common import strip_whitespace_between_tags
 from anki_formatter.formatters.html import format_html
 
-CONFIG = mw.addonManager.getConfig(__name__)["imageOcclusionSVG"]
+if mw:
+    CONFIG = mw.addonManager.getConfig(__name__)["imageOcclusionSVG"]
+else:  # pragma: no cover
+    # worker processes have no main window, use the default config
+    with open(
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.json"),
+        encoding="utf-8",
+    ) as f:
+        CONFIG = json.load(f)["imageOcclusionSVG"]
 
 STROKE: bool = CONFIG["stroke"]["active"]
 STROKE_COLOR: str = CONFIG["stroke"]["color"]
@@ -379,7 +394,7 @@ def postprocess(soup: BeautifulSoup) -> str:
 
 
 def format_image_occlusion_svg(svg: str) -> str:
-    original_soup = BeautifulSoup(svg, "html.parser")
+    original_soup = BeautifulSoup(svg, FIELD_PARSER)
 
     if (
         len(original_soup.contents) != 1
@@ -388,7 +403,7 @@ def format_image_occlusion_svg(svg: str) -> str:
     ):
         raise ValueError  # pragma: no cover
 
-    new_soup = BeautifulSoup("", "html.parser")
+    new_soup = BeautifulSoup("", FIELD_PARSER)
     new_soup.append(SVG.from_tag(original_soup.svg).to_tag())
 
     svg = postprocess(new_soup)
@@ -402,13 +417,19 @@ def format_image_occlusion_svg(svg: str) -> str:
 def format_image_occlusion_field(
     value: str,
     minimized: bool,
+    write_media: bool = True,
+    media_directory: str | None = None,
 ) -> tuple[str, bool]:  # pragma: no cover
     if minimized:  # pragma: no cover
         raise NotImplementedError
 
+    # the media folder of the collection that is formatted
+    if media_directory is None:
+        raise ValueError("The media folder of the collection is unknown.")
+
     formatted_value, _ = format_html(value, False)
 
-    soup = BeautifulSoup(formatted_value, "html.parser")
+    soup = BeautifulSoup(formatted_value, FIELD_PARSER)
 
     if (
         len(soup.contents) != 1
@@ -418,14 +439,14 @@ def format_image_occlusion_field(
     ):
         raise ValueError
 
-    img_src = os.path.join(mw.pm.profileFolder(), "collection.media", soup.img.attrs["src"])
+    img_src = os.path.join(media_directory, soup.img.attrs["src"])
 
     with open(img_src, encoding="utf-8") as f:
         svg = f.read()
 
     formatted_svg = format_image_occlusion_svg(svg)
 
-    if svg != formatted_svg:
+    if write_media and svg != formatted_svg:
         with open(img_src, mode="w", encoding="utf-8") as f:
             f.write(formatted_svg)
 
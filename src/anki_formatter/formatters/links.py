@@ -1,19 +1,16 @@
 from __future__ import annotations
 
 import re
-import sys
 
 from bs4 import BeautifulSoup
 from bs4 import Tag
 
+from anki_formatter.formatters.common import FIELD_PARSER
 from anki_formatter.formatters.common import fix_encoding
 from anki_formatter.formatters.common import get_website_title
+from anki_formatter.formatters.common import InvalidValueError
 from anki_formatter.formatters.common import replace_symbols
 
-if "pytest" not in sys.modules:  # pragma: no cover
-    from aqt.utils import showCritical
-    from aqt.utils import showInfo
-
 
 def format_links(value: str, minimized: bool = False) -> tuple[str, bool]:
     formatted_value = fix_encoding(value)
@@ -23,27 +20,24 @@ def format_links(value: str, minimized: bool = False) -> tuple[str, bool]:
     if formatted_value == "":
         return formatted_value, value != formatted_value
 
-    soup = BeautifulSoup(formatted_value, "html.parser")
+    soup = BeautifulSoup(formatted_value, FIELD_PARSER)
 
     links: list[tuple[str, str]] = []
     for element in soup.contents:
         if not isinstance(element, Tag):
             if isinstance(element, str) and element == "\n":
                 continue
-            else:  # pragma: no cover
-                showCritical(f"Invalid link: {element}")
-                return value, False
+            else:
+                raise InvalidValueError(f"Invalid link: {element}")
 
         if element.name == "br":
             continue
 
-        if element.name != "a" or not element.get("href"):  # pragma: no cover
-            showCritical(f"Invalid link: {element}")
-            return value, False
+        if element.name != "a" or not element.get("href"):
+            raise InvalidValueError(f"Invalid link: {element}")
 
         name = element.get_text().strip()  # noqa: F841
         href = element.attrs["href"].strip()
-        title = get_website_title(href)
 
         if "wikipedia.org/wiki" in href:
             regex = r"^(.*) – Wikipedia$"
@@ -60,13 +54,13 @@ def format_links(value: str, minimized: bool = False) -> tuple[str, bool]:
         elif "embryotox.de/arzneimittel" in href:
             regex = r"^Embryotox - (.*)$"
             page_name = "Embryotox"
-        else:  # pragma: no cover
-            showInfo(f"Unknown website: {href}")
+        else:
+            raise InvalidValueError(f"Unknown website: {href}")
 
+        title = get_website_title(href)
         match = re.match(regex, title)
-        if not match:  # pragma: no cover
-            showCritical(f"Could not parse website title: {title} ({href})")
-            return value, False
+        if not match:
+            raise InvalidValueError(f"Could not parse website title: {title} ({href})")
         page_title = match.group(1).strip()
 
         links.append((f"{page_title} – {page_name}", href))
@@ -1,16 +1,13 @@
 from __future__ import annotations
 
-import sys
-
 from bs4 import BeautifulSoup
 from bs4 import Tag
 
+from anki_formatter.formatters.common import FIELD_PARSER
 from anki_formatter.formatters.common import fix_encoding
+from anki_formatter.formatters.common import InvalidValueError
 from anki_formatter.formatters.common import replace_symbols
 
-if "pytest" not in sys.modules:  # pragma: no cover
-    from aqt.utils import showCritical
-
 
 def format_meditricks(value: str, minimized: bool = False) -> tuple[str, bool]:
     formatted_value = fix_encoding(value)
@@ -20,27 +17,21 @@ def format_meditricks(value: str, minimized: bool = False) -> tuple[str, bool]:
     if formatted_value == "":
         return formatted_value, value != formatted_value
 
-    soup = BeautifulSoup(formatted_value, "html.parser")
+    soup = BeautifulSoup(formatted_value, FIELD_PARSER)
 
-    if len(soup.contents) != 1:  # pragma: no cover
-        showCritical(f"Invalid meditricks: {value}")
-        return value, False
+    if len(soup.contents) != 1:
+        raise InvalidValueError(f"Invalid meditricks: {value}")
 
     element = soup.contents[0]
-    if not isinstance(element, Tag):  # pragma: no cover
-        showCritical(f"Invalid meditricks: {value}")
-        return value, False
-
-    if element.name != "div" or element.attrs["class"] != [
-        "mt-anki-iframe-src",
-    ]:  # pragma: no cover
-        showCritical(f"Invalid meditricks: {value}")
-        return value, False
-
-    meditricks_id = element.attrs["data-src"].strip()
-    if not meditricks_id or not meditricks_id.isdigit():  # pragma: no cover
-        showCritical(f"Invalid meditricks: {value}")
-        return value, False
+    if not isinstance(element, Tag):
+        raise InvalidValueError(f"Invalid meditricks: {value}")
+
+    if element.name != "div" or element.attrs.get("class") != ["mt-anki-iframe-src"]:
+        raise InvalidValueError(f"Invalid meditricks: {value}")
+
+    meditricks_id = element.attrs.get("data-src", "").strip()
+    if not meditricks_id or not meditricks_id.isdigit():
+        raise InvalidValueError(f"Invalid meditricks: {value}")
 
     formatted_value = f'<div class="mt-anki-iframe-src" data-src="{meditricks_id}"></div>'
     return formatted_value, value != formatted_value
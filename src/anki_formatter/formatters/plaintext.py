@@ -4,6 +4,7 @@ import warnings
 
 from bs4 import BeautifulSoup
 
+from anki_formatter.formatters.common import FIELD_PARSER
 from anki_formatter.formatters.common import fix_encoding
 from anki_formatter.formatters.common import replace_symbols
 
@@ -14,7 +15,7 @@ def convert_to_plaintext(value: str, minimized: bool) -> tuple[str, bool]:
 
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        soup = BeautifulSoup(formatted_value, "html.parser")
+        soup = BeautifulSoup(formatted_value, FIELD_PARSER)
 
     formatted_value = soup.get_text().strip()
 
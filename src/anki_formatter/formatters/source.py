@@ -1,13 +1,9 @@
 from __future__ import annotations
 
-import sys
-
 from anki_formatter.formatters.common import fix_encoding
+from anki_formatter.formatters.common import InvalidValueError
 from anki_formatter.formatters.common import replace_symbols
 
-if "pytest" not in sys.modules:  # pragma: no cover
-    from aqt.utils import showCritical
-
 
 def format_source(value: str, minimized: bool) -> tuple[str, bool]:
     formatted_value = fix_encoding(value)
@@ -18,8 +14,8 @@ def format_source(value: str, minimized: bool) -> tuple[str, bool]:
         return formatted_value, value != formatted_value
 
     for source in formatted_value.split(", "):
-        if source not in {"AMBOSS", "DocCheck", "Wikipedia", "via medici"}:  # pragma: no cover
-            showCritical(f"Unknown source: {source}")
+        if source not in {"AMBOSS", "DocCheck", "Wikipedia", "via medici"}:
+            raise InvalidValueError(f"Unknown source: {source}")
 
     formatted_value = ", ".join(sorted(value.split(", ")))
 
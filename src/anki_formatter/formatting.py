@@ -0,0 +1,518 @@
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from collections.abc import Generator
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from anki.collection import Collection
+from anki.collection import OpChanges
+from anki.models import NotetypeId
+from anki.notes import Note
+from anki.notes import NoteId
+from anki.utils import split_fields
+
+from anki_formatter.cache import CanonicalCache
+from anki_formatter.config import FieldPlan
+from anki_formatter.config import Plan
+from anki_formatter.errors import error_message
+from anki_formatter.errors import FieldError
+from anki_formatter.formatters import is_pure
+from anki_formatter.formatters import READ_ONLY_FORMATTERS
+from anki_formatter.formatters import with_media_directory
+from anki_formatter.memo import FormatterMemo
+from anki_formatter.metrics import Metrics
+from anki_formatter.parallel import Job
+from anki_formatter.parallel import ParallelFormatter
+from anki_formatter.parallel import Result
+from anki_formatter.report import DryRunReport
+
+
+class FormattingError(Exception):
+    pass
+
+
+class Options(NamedTuple):
+    minimized: bool
+    workers: int
+    threshold: int
+    chunk_size: int
+    cache_path: str | None
+    last_run_key: str | None = None
+    dry_run: bool = False
+    metrics_path: str | None = None
+    stop_on_error: bool = False
+
+
+class NoteFields(NamedTuple):
+    id: int
+    mid: int
+    fields: list[str]
+
+
+class FormatResult(NamedTuple):
+    changes: OpChanges | None
+    total: int
+    processed: int
+    formatted: int
+    speedup: float | None
+    metrics: Metrics
+    errors: list[FieldError]
+    report: DryRunReport | None = None
+
+
+def _ignore_progress(processed: int, total: int, elapsed: float) -> None:
+    pass
+
+
+def _never() -> bool:
+    return False
+
+
+def _chunks(note_ids: Sequence[NoteId], size: int) -> Generator[Sequence[NoteId], None, None]:
+    for start in range(0, len(note_ids), size):
+        end = start + size
+        yield note_ids[start:end]
+
+
+def _load_notes(col: Collection, note_ids: Sequence[NoteId]) -> list[NoteFields]:
+    assert col.db
+
+    ids = ", ".join(str(note_id) for note_id in note_ids)
+    notes = {
+        note_id: NoteFields(note_id, note_type_id, split_fields(fields))
+        for note_id, note_type_id, fields in col.db.all(
+            f"SELECT id, mid, flds FROM notes WHERE id IN ({ids})",
+        )
+    }
+
+    # notes deleted since the selection are skipped
+    return [notes[note_id] for note_id in note_ids if note_id in notes]
+
+
+def _notes(col: Collection, formatted_notes: list[NoteFields]) -> list[Note]:
+    notes = []
+
+    for formatted_note in formatted_notes:
+        note = col.get_note(NoteId(formatted_note.id))
+        note.fields = formatted_note.fields
+        notes.append(note)
+
+    return notes
+
+
+def _failed_notes_key(last_run_key: str) -> str:
+    return f"{last_run_key}FailedNotes"
+
+
+def modified_note_ids(
+    col: Collection,
+    plan: Plan,
+    last_run_key: str,
+) -> Sequence[NoteId]:
+    assert col.db
+
+    # notes that could not be formatted by the last run are selected again
+    since = col.get_config(last_run_key, 0)
+    failed_ids = ", ".join(
+        str(note_id) for note_id in col.get_config(_failed_notes_key(last_run_key), [])
+    )
+
+    # notes of note types with config errors are included, so that the error is reported
+    note_type_ids = ", ".join(str(note_type_id) for note_type_id in [*plan.fields, *plan.errors])
+
+    return col.db.list(
+        f"SELECT id FROM notes WHERE (mod > ? OR id IN ({failed_ids})) "
+        f"AND mid IN ({note_type_ids}) ORDER BY id",
+        since,
+    )
+
+
+class BatchFormatter:
+    def __init__(
+        self,
+        plan: Plan,
+        options: Options,
+        *,
+        on_progress: Callable[[int, int, float], None] = _ignore_progress,
+        want_cancel: Callable[[], bool] = _never,
+    ) -> None:
+        if options.dry_run:
+            plan = plan._replace(
+                fields={
+                    note_type_id: [
+                        field._replace(
+                            formatter=READ_ONLY_FORMATTERS.get(field.formatter, field.formatter),
+                        )
+                        for field in fields
+                    ]
+                    for note_type_id, fields in plan.fields.items()
+                },
+            )
+
+        self.plan = plan
+        self.options = options
+
+        self.__on_progress = on_progress
+        self.__want_cancel = want_cancel
+
+        self.__cache: CanonicalCache | None = None
+        self.__report: DryRunReport | None = None
+        self.__metrics = Metrics()
+        self.__errors: list[FieldError] = []
+        self.__memo = FormatterMemo()
+
+    def __configured_notes(self, col: Collection, notes: list[NoteFields]) -> list[NoteFields]:
+        configured_notes = []
+
+        for note in notes:
+            if note.mid in self.plan.fields:
+                configured_notes.append(note)
+                continue
+
+            # notes of note types without a complete config are left unchanged
+            if note.mid in self.plan.errors:
+                fields = self.plan.errors[note.mid]
+                message = "No formatter is configured for this field."
+            else:
+                note_type = col.models.get(NotetypeId(note.mid))
+                fields = [field["name"] for field in note_type["flds"]] if note_type else []
+                name = note_type["name"] if note_type else note.mid
+                message = f'Could not find a config for note type "{name}".'
+
+            for field in fields:
+                self.__add_error(FieldError(note.id, field, "", message))
+
+        return configured_notes
+
+    def __is_canonical(self, field: FieldPlan, value: str) -> bool:
+        # fields of formatters with side effects are never skipped
+        return (
+            self.__cache is not None
+            and is_pure(field.formatter)
+            and self.__cache.is_canonical(field.cache_key, value, self.options.minimized)
+        )
+
+    def __add_canonical(self, field: FieldPlan, value: str) -> None:
+        if self.__cache is not None and is_pure(field.formatter):
+            self.__cache.add(field.cache_key, value, self.options.minimized)
+
+    def __add_error(self, error: FieldError) -> None:
+        if self.options.stop_on_error:
+            raise FormattingError(
+                f'Could not format field "{error.field}" of note {error.note_id}: {error.message}',
+            )
+
+        # the field is left unchanged and the run continues with the next field
+        self.__errors.append(error)
+
+    def __memoized(self, field: FieldPlan, value: str) -> tuple[str, bool] | None:
+        # results of formatters with side effects are never reused
+        if not is_pure(field.formatter):
+            return None
+
+        return self.__memo.get(field.cache_key, value, self.options.minimized)
+
+    def __call_formatter(
+        self,
+        note: NoteFields,
+        field: FieldPlan,
+        value: str,
+    ) -> tuple[str, bool] | None:
+        if (memoized := self.__memoized(field, value)) is not None:
+            return memoized
+
+        start = time.perf_counter()
+        try:
+            formatted_value, did_format = field.formatter(value, self.options.minimized)
+        except Exception as e:
+            self.__metrics.record(
+                field.formatter_name,
+                time.perf_counter() - start,
+                value,
+                value,
+                False,
+                failed=True,
+            )
+            self.__add_error(
+                FieldError(note.id, field.name, field.formatter_name, error_message(e)),
+            )
+            return None
+
+        self.__metrics.record(
+            field.formatter_name,
+            time.perf_counter() - start,
+            value,
+            formatted_value,
+            did_format,
+        )
+
+        if is_pure(field.formatter):
+            self.__memo.add(
+                field.cache_key,
+                value,
+                self.options.minimized,
+                (formatted_value, did_format),
+            )
+
+        return formatted_value, did_format
+
+    def __format_field(self, note: NoteFields, field: FieldPlan) -> bool:
+        original = note.fields[field.ord]
+
+        if self.__is_canonical(field, original):
+            return False
+
+        if (result := self.__call_formatter(note, field, original)) is None:
+            return False
+        formatted_value, did_format = result
+
+        if self.__report is not None and did_format:
+            self.__report.add_change(
+                note.id,
+                field.name,
+                field.formatter_name,
+                original,
+                formatted_value,
+            )
+
+        if did_format:
+            note.fields[field.ord] = formatted_value
+        else:
+            # formatters are not idempotent, only values they leave unchanged are canonical
+            self.__add_canonical(field, original)
+
+        return did_format
+
+    def __format_note(self, note: NoteFields) -> bool:
+        changed = False
+
+        for field in self.plan.fields[note.mid]:
+            if self.__format_field(note, field):
+                changed = True
+
+        return changed
+
+    def __format_notes_parallel(
+        self,
+        notes: list[NoteFields],
+        parallel: ParallelFormatter,
+    ) -> list[NoteFields]:
+        notes_by_id = {note.id: note for note in notes}
+        formatted_notes: dict[int, NoteFields] = {}
+
+        # formatters with side effects are not sent to the worker processes
+        jobs: list[Job] = []
+        job_fields: list[FieldPlan] = []
+        queued: set[tuple[str, str]] = set()
+        duplicates: list[tuple[NoteFields, FieldPlan]] = []
+        for note in notes:
+            for field in self.plan.fields[note.mid]:
+                value = note.fields[field.ord]
+
+                if not is_pure(field.formatter):
+                    if self.__format_field(note, field):
+                        formatted_notes[note.id] = note
+                elif self.__is_canonical(field, value):
+                    continue
+                elif (field.cache_key, value) in queued or (
+                    field.cache_key,
+                    value,
+                    self.options.minimized,
+                ) in self.__memo:
+                    # every value is only sent once, duplicates are taken from the memo afterwards
+                    duplicates.append((note, field))
+                else:
+                    queued.add((field.cache_key, value))
+                    jobs.append(
+                        Job(
+                            note_id=note.id,
+                            ord=field.ord,
+                            field=field.name,
+                            formatter_name=field.formatter_name,
+                            formatter=field.formatter,
+                            value=value,
+                        ),
+                    )
+                    job_fields.append(field)
+
+        try:
+            with self.__metrics.stage("formatParallel"):
+                results, errors = parallel.format(jobs, self.options.minimized)
+        except Exception as e:
+            raise FormattingError(str(e)) from e
+
+        # the workers finish in any order, errors are reported in the order of the notes
+        order = {(job.note_id, job.field): index for index, job in enumerate(jobs)}
+        for error in sorted(errors, key=lambda error: order[(error.note_id, error.field)]):
+            self.__add_error(error)
+        failed = {(error.note_id, error.field) for error in errors}
+
+        if self.__report is not None:
+            self.__add_parallel_report(jobs, job_fields, results)
+
+        for note_id, ord, value in results:
+            notes_by_id[note_id].fields[ord] = value
+            formatted_notes[note_id] = notes_by_id[note_id]
+
+        formatted_values = {(result.note_id, result.ord): result.value for result in results}
+        for job, field in zip(jobs, job_fields):
+            if (job.note_id, job.field) not in failed:
+                formatted_value = formatted_values.get((job.note_id, job.ord))
+                if formatted_value is None:
+                    self.__add_canonical(field, job.value)
+
+                self.__memo.add(
+                    field.cache_key,
+                    job.value,
+                    self.options.minimized,
+                    (job.value, False) if formatted_value is None else (formatted_value, True),
+                )
+
+        for note, field in duplicates:
+            if self.__format_field(note, field):
+                formatted_notes[note.id] = note
+
+        return list(formatted_notes.values())
+
+    def __add_parallel_report(
+        self,
+        jobs: list[Job],
+        job_fields: list[FieldPlan],
+        results: list[Result],
+    ) -> None:
+        assert self.__report is not None
+
+        formatted_values = {(result.note_id, result.ord): result.value for result in results}
+
+        for job, field in zip(jobs, job_fields):
+            formatted_value = formatted_values.get((job.note_id, job.ord))
+
+            if formatted_value is not None:
+                self.__report.add_change(
+                    job.note_id,
+                    field.name,
+                    field.formatter_name,
+                    job.value,
+                    formatted_value,
+                )
+
+    def format_notes(self, col: Collection, note_ids: Sequence[NoteId]) -> FormatResult:
+        start = time.monotonic()
+        options = self.options
+        use_parallel = options.workers > 1 and len(note_ids) >= options.threshold
+
+        # formatters of media files work on the media folder of this collection
+        self.plan = self.plan._replace(
+            fields={
+                note_type_id: [
+                    field._replace(
+                        formatter=with_media_directory(field.formatter, col.media.dir()),
+                    )
+                    for field in fields
+                ]
+                for note_type_id, fields in self.plan.fields.items()
+            },
+        )
+
+        processed = 0
+        formatted = 0
+        self.__metrics = Metrics()
+        self.__errors = []
+        self.__memo = FormatterMemo()
+
+        # a dry run neither writes notes nor the cache, and it creates no undo entry
+        if options.dry_run:
+            undo_position = None
+            self.__report = DryRunReport(options.minimized)
+        else:
+            # every chunk is committed right away and merged into a single undo entry
+            undo_position = col.add_custom_undo_entry("Format Notes")
+            self.__cache = CanonicalCache(options.cache_path) if options.cache_path else None
+
+        try:
+            with ParallelFormatter(options.workers) as parallel:
+                for chunk in _chunks(note_ids, options.chunk_size):
+                    if self.__want_cancel():
+                        break
+
+                    # notes are only loaded as a whole if they have to be written
+                    with self.__metrics.stage("loadNotes"):
+                        notes = _load_notes(col, chunk)
+                    notes = self.__configured_notes(col, notes)
+
+                    if use_parallel:
+                        formatted_notes = self.__format_notes_parallel(notes, parallel)
+                    else:
+                        formatted_notes = [note for note in notes if self.__format_note(note)]
+
+                    if undo_position is not None:
+                        # Anki only keeps the last 30 undo steps, so every chunk is merged at once
+                        with self.__metrics.stage("updateNotes"):
+                            col.update_notes(_notes(col, formatted_notes))
+                            col.merge_undo_entries(undo_position)
+
+                    # only remember values as canonical once the notes are written
+                    if self.__cache is not None:
+                        with self.__metrics.stage("commitCache"):
+                            self.__cache.commit()
+
+                    processed += len(chunk)
+                    formatted += len(formatted_notes)
+                    self.__on_progress(processed, len(note_ids), time.monotonic() - start)
+
+            # formatting bumps the modification time, so the mark is taken after the last write,
+            # notes with fields that could not be formatted are selected again by the next run
+            if options.last_run_key and not options.dry_run and processed == len(note_ids):
+                col.set_config(options.last_run_key, int(time.time()), undoable=True)
+                col.set_config(
+                    _failed_notes_key(options.last_run_key),
+                    sorted({error.note_id for error in self.__errors}),
+                    undoable=True,
+                )
+        finally:
+            changes = col.merge_undo_entries(undo_position) if undo_position is not None else None
+
+            if self.__cache is not None:
+                self.__cache.close()
+                self.__cache = None
+
+        seconds = time.monotonic() - start
+        metrics = self.__metrics
+        metrics.merge(parallel.metrics)
+        metrics.count("memoHits", self.__memo.hits)
+        metrics.count("memoMisses", self.__memo.misses)
+
+        errors, self.__errors = self.__errors, []
+
+        report, self.__report = self.__report, None
+        if report is not None:
+            report.notes = processed
+            report.seconds = seconds
+            report.metrics = metrics
+            report.errors = errors
+
+        if options.metrics_path:
+            with open(options.metrics_path, "w", encoding="utf-8") as f:
+                f.write(
+                    metrics.to_json(
+                        minimized=options.minimized,
+                        dryRun=options.dry_run,
+                        notes=processed,
+                        formattedNotes=formatted,
+                        seconds=round(seconds, 3),
+                        notesPerSecond=round(processed / seconds, 1) if seconds else None,
+                    ),
+                )
+
+        return FormatResult(
+            changes=changes,
+            total=len(note_ids),
+            processed=processed,
+            formatted=formatted,
+            speedup=parallel.speedup if use_parallel else None,
+            metrics=metrics,
+            errors=errors,
+            report=report,
+        )
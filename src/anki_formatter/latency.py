@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+# formatting time per byte of typical html fields, refined with every measured call
+DEFAULT_SECONDS_PER_BYTE = 5e-6
+# small fields are dominated by the fixed cost of a call, they are counted as this size
+MIN_BYTES = 1024
+# the estimate follows slow calls quickly and fast calls slowly, tracking the slow end
+RISE = 0.5
+DECAY = 0.02
+
+
+class LatencyEstimator:
+    def __init__(self) -> None:
+        self.__seconds_per_byte: dict[str, float] = {}
+
+    def estimate(self, formatter: str, value: str) -> float:
+        seconds_per_byte = self.__seconds_per_byte.get(formatter, DEFAULT_SECONDS_PER_BYTE)
+
+        return seconds_per_byte * max(len(value.encode("utf-8")), MIN_BYTES)
+
+    def record(self, formatter: str, value: str, seconds: float) -> None:
+        previous = self.__seconds_per_byte.get(formatter, DEFAULT_SECONDS_PER_BYTE)
+        measured = seconds / max(len(value.encode("utf-8")), MIN_BYTES)
+
+        smoothing = RISE if measured > previous else DECAY
+        self.__seconds_per_byte[formatter] = previous + smoothing * (measured - previous)
@@ -1,68 +1,56 @@
 from __future__ import annotations
 
-import json
 import os
-from collections.abc import Callable
+import time
 from collections.abc import Generator
+from collections.abc import Sequence
+from concurrent.futures import Future
 from contextlib import contextmanager
+from weakref import WeakSet
 
 from anki.notes import Note
+from anki.notes import NoteId
 from aqt import mw
 from aqt.browser import Browser
+from aqt.editor import Editor
+from aqt.operations import CollectionOp
+from aqt.operations import QueryOp
+from aqt.qt import QWidget
 from aqt.utils import showCritical
 from aqt.utils import showInfo
+from aqt.utils import showWarning
+from aqt.utils import tooltip
+
+from anki_formatter.config import ConfigError
+from anki_formatter.config import FieldPlan
+from anki_formatter.config import load_config
+from anki_formatter.config import Plan
+from anki_formatter.errors import error_message
+from anki_formatter.errors import FieldError
+from anki_formatter.formatters import is_pure
+from anki_formatter.formatting import BatchFormatter
+from anki_formatter.formatting import FormatResult
+from anki_formatter.formatting import FormattingError
+from anki_formatter.formatting import modified_note_ids
+from anki_formatter.formatting import Options
+from anki_formatter.latency import LatencyEstimator
+from anki_formatter.report import DryRunReport
+
+MAX_ERRORS_SHOWN = 20
+
+_EDITORS: WeakSet[Editor] = WeakSet()
+_LATENCY = LatencyEstimator()
+
+
+def _userfiles_directory() -> str:
+    addons_path = mw.addonManager.addonsFolder()
 
-from anki_formatter.formatters import FORMATTERS
-
-
-def _load_config(directory: str) -> dict[str, dict[str, Callable[[str, bool], tuple[str, bool]]]]:
-    config = {
-        "ProjektAnkiCloze": {
-            "Text": FORMATTERS["html"],
-            "Extra": FORMATTERS["html"],
-            "Bild": FORMATTERS["html"],
-            "Eigene Notizen & Bilder": FORMATTERS["clear"],
-            "Eigene Prüfungsfragen": FORMATTERS["clear"],
-            "Definitionen": FORMATTERS["html"],
-            "Merksprüche": FORMATTERS["html"],
-            "Klinik": FORMATTERS["html"],
-            "Präparat": FORMATTERS["html"],
-            "Memes": FORMATTERS["html"],
-            "Meditricks": FORMATTERS["meditricks"],
-            "AMBOSS-Link": FORMATTERS["plaintext"],
-            "Thieme via medici-Link": FORMATTERS["plaintext"],
-            "weitere Links": FORMATTERS["links"],
-            "Quelle": FORMATTERS["source"],
-            "Datum": FORMATTERS["date"],
-            "One by one": FORMATTERS["plaintext"],  # TODO
-            "Note ID": FORMATTERS["plaintext"],  # TODO
-            "ankihub_id": FORMATTERS["plaintext"],  # TODO
-        },
-    }
-
-    for folder_name in os.listdir(directory):
-        folder = os.path.join(directory, folder_name)
-
-        if not os.path.isdir(folder):
-            continue
-
-        if os.path.basename(folder) in (".git",):
-            continue
-
-        with open(os.path.join(folder, "model.json"), encoding="utf-8") as f:
-            data = json.load(f)
-
-        config[data["name"]] = {
-            field["name"]: FORMATTERS[field.get("formatter", "skip")] for field in data["fields"]
-        }
-
-    return config
+    return os.path.join(addons_path, "user_files")
 
 
 @contextmanager
 def _template_directory() -> Generator[str, None, None]:
-    addons_path = mw.addonManager.addonsFolder()
-    userfiles_path = os.path.join(addons_path, "user_files")
+    userfiles_path = _userfiles_directory()
     templates_path = os.path.join(userfiles_path, "templates")
 
     os.makedirs(templates_path, exist_ok=True)
@@ -70,70 +58,261 @@ def _template_directory() -> Generator[str, None, None]:
     yield templates_path
 
 
-def _selected_notes(browser: Browser) -> Generator[Note, None, None]:
-    for note_id in browser.selectedNotes():
-        yield mw.col.getNote(note_id)
+def _update_progress(processed: int, total: int, elapsed: float) -> None:
+    rate = processed / elapsed if elapsed else 0.0
+    remaining = (total - processed) / rate if rate else 0.0
+
+    label = (
+        f"Formatted {processed} of {total} notes\n"
+        f"{rate:.0f} notes/s, {remaining // 60:.0f}:{remaining % 60:02.0f} remaining"
+    )
+
+    mw.taskman.run_on_main(lambda: mw.progress.update(label=label, value=processed, max=total))
+
+
+def _write_report(report: DryRunReport) -> str:
+    reports_path = os.path.join(_userfiles_directory(), "reports")
+    os.makedirs(reports_path, exist_ok=True)
+
+    report_path = os.path.join(reports_path, f"dry-run-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(report_path, mode="w", encoding="utf-8") as f:
+        f.write(report.to_json())
 
+    return report_path
 
-def _note_fields(note: Note) -> Generator[str, None, None]:
-    for field in note.note_type().get("flds", []):
-        yield field["name"]
 
+def _metrics_path() -> str:
+    metrics_path = os.path.join(_userfiles_directory(), "metrics")
+    os.makedirs(metrics_path, exist_ok=True)
 
-def _format_note(
-    note: Note,
-    config: dict[str, dict[str, Callable[[str, bool], tuple[str, bool]]]],
-    minimized: bool,
-) -> Note | None:
-    changed = False
+    return os.path.join(metrics_path, f"run-{time.strftime('%Y%m%d-%H%M%S')}.json")
+
+
+def _errors_message(errors: list[FieldError]) -> str:
+    lines = [
+        f"Note {error.note_id}, {error.field}: {error.message}"
+        for error in errors[:MAX_ERRORS_SHOWN]
+    ]
+    if len(errors) > MAX_ERRORS_SHOWN:
+        lines.append(f"… and {len(errors) - MAX_ERRORS_SHOWN} more")
+
+    note_ids = ",".join(
+        str(note_id) for note_id in dict.fromkeys(error.note_id for error in errors)
+    )
+
+    return (
+        f"{len(errors)} fields could not be formatted and were left unchanged:\n"
+        + "\n".join(lines)
+        + f"\n\nSearch: nid:{note_ids}"
+    )
+
+
+def _show_message(message: str, errors: list[FieldError]) -> None:
+    if errors:
+        showWarning(f"{message}\n\n{_errors_message(errors)}")
+    else:
+        showInfo(message)
 
-    for field in _note_fields(note):
-        key = next((key for key in config if note.note_type()["name"].startswith(key)), None)
 
-        if key is None:
-            showCritical(f'Could not find a config for note type "{note.note_type()["name"]}".')
-            raise ValueError
+def _show_dry_run_result(result: FormatResult) -> None:
+    assert result.report is not None
 
-        formatter = config[key][field]
+    report_path = _write_report(result.report)
 
-        original = note[field]
-        try:
-            formatted_value, did_format = formatter(original, minimized)
-        except Exception as e:
-            showCritical(f"Could not format note {dict(note)}!")
-            raise e
+    _show_message(
+        f"{result.report.changed_notes} of {result.processed} notes would be updated "
+        f"({len(result.report.changes)} fields).\n\nReport: {report_path}",
+        result.errors,
+    )
 
-        if did_format:
-            note[field] = formatted_value
-            changed = True
 
-    if changed:
-        return note
+def _show_result(result: FormatResult, workers: int) -> None:
+    if result.formatted == 1:
+        message = f"Updated {result.formatted} note!"
     else:
+        message = f"Updated {result.formatted} notes!"
+
+    if result.processed < result.total:
+        message = f"Cancelled after {result.processed} of {result.total} notes.\n\n{message}"
+
+    if result.speedup is not None:
+        message += f"\n\nFormatted with {workers} workers ({result.speedup:.1f}x speedup)."
+
+    _show_message(message, result.errors)
+
+
+def _show_error(exception: Exception) -> None:
+    # expected errors are shown as a message, only unexpected ones get Anki's error dialog
+    if isinstance(exception, FormattingError):
+        showCritical(str(exception))
+        return
+
+    raise exception
+
+
+def _plan() -> Plan | None:
+    try:
+        with _template_directory() as models_dir:
+            return load_config(models_dir, mw.col.models.all())
+    except ConfigError as e:
+        showCritical(str(e))
         return None
 
 
+def _options(minimized: bool) -> Options:
+    config = mw.addonManager.getConfig(__name__)
+
+    return Options(
+        minimized=minimized,
+        workers=config["parallel"]["workers"] or os.cpu_count() or 1,
+        threshold=config["parallel"]["threshold"],
+        chunk_size=config["chunkSize"],
+        cache_path=os.path.join(_userfiles_directory(), "cache.db") if config["cache"] else None,
+        metrics_path=_metrics_path() if config["metrics"] else None,
+        stop_on_error=config["stopOnError"],
+    )
+
+
+def _run(
+    parent: QWidget,
+    note_ids: Sequence[NoteId],
+    plan: Plan,
+    options: Options,
+) -> None:
+    formatter = BatchFormatter(
+        plan,
+        options,
+        on_progress=_update_progress,
+        want_cancel=mw.progress.want_cancel,
+    )
+
+    if options.dry_run:
+        QueryOp(
+            parent=parent,
+            op=lambda col: formatter.format_notes(col, note_ids),
+            success=_show_dry_run_result,
+        ).failure(_show_error).with_progress().run_in_background()
+    else:
+        CollectionOp(
+            parent=parent,
+            op=lambda col: formatter.format_notes(col, note_ids),
+        ).success(lambda result: _show_result(result, options.workers)).failure(
+            _show_error,
+        ).run_in_background()
+
+
 def main(browser: Browser, minimized: bool) -> None:
-    mw.checkpoint("Format Notes")
-    mw.progress.start()
+    if (plan := _plan()) is None:
+        return
 
-    with _template_directory() as models_dir:
-        config = _load_config(models_dir)
+    _run(browser, browser.selectedNotes(), plan, _options(minimized))
 
-    formatted_notes = []
-    for note in _selected_notes(browser):
-        formatted_note = _format_note(note, config, minimized)
 
-        if formatted_note:
-            formatted_notes.append(formatted_note)
+def main_dry_run(browser: Browser, minimized: bool) -> None:
+    if (plan := _plan()) is None:
+        return
 
-    mw.col.update_notes(formatted_notes)
+    _run(browser, browser.selectedNotes(), plan, _options(minimized)._replace(dry_run=True))
 
-    mw.progress.finish()
-    mw.reset()
 
-    num_formatted = len(formatted_notes)
-    if num_formatted == 1:
-        showInfo(f"Updated {num_formatted} note!")
-    else:
-        showInfo(f"Updated {num_formatted} notes!")
+def main_modified(browser: Browser, minimized: bool) -> None:
+    if (plan := _plan()) is None:
+        return
+
+    last_run_key = f"ankiFormatterLastRun{'Minimized' if minimized else 'Readable'}"
+    options = _options(minimized)._replace(last_run_key=last_run_key)
+
+    note_ids = modified_note_ids(mw.col, plan, last_run_key)
+
+    if not note_ids:
+        showInfo("No notes were modified since the last run!")
+        return
+
+    _run(browser, note_ids, plan, options)
+
+
+def _blur_field(note: Note, ord: int) -> FieldPlan | None:
+    if (note_type := note.note_type()) is None:
+        return None
+
+    try:
+        with _template_directory() as models_dir:
+            plan = load_config(models_dir, [note_type])
+    except ConfigError:
+        return None
+
+    # formatters with side effects (network, media files) are left to the browser actions
+    return next(
+        (
+            field
+            for field in plan.fields.get(note.mid, [])
+            if field.ord == ord and is_pure(field.formatter)
+        ),
+        None,
+    )
+
+
+def _format_field(field: FieldPlan, value: str, minimized: bool) -> str | None:
+    start = time.perf_counter()
+    try:
+        formatted_value, did_format = field.formatter(value, minimized)
+    except Exception as e:
+        message = f"Could not format {field.name}: {error_message(e)}"
+        mw.taskman.run_on_main(lambda: tooltip(message))
+        return None
+
+    _LATENCY.record(field.formatter_name, value, time.perf_counter() - start)
+
+    return formatted_value if did_format else None
+
+
+def _save_note(note: Note) -> None:
+    # notes in the add dialog are saved when they are added
+    if note.id:
+        mw.col.update_note(note)
+
+
+def _apply_deferred(future: Future[str | None], note: Note, field: FieldPlan, value: str) -> None:
+    formatted_value = future.result()
+
+    # the field may have been edited again while it was formatted
+    if formatted_value is None or note.fields[field.ord] != value:
+        return
+
+    note.fields[field.ord] = formatted_value
+    _save_note(note)
+
+    for editor in _EDITORS:
+        if editor.note is note:
+            editor.loadNoteKeepingFocus()
+
+
+def track_editor(editor: Editor) -> None:
+    _EDITORS.add(editor)
+
+
+def format_on_blur(changed: bool, note: Note, ord: int) -> bool:
+    config = mw.addonManager.getConfig(__name__)["formatOnBlur"]
+
+    if not config["enabled"] or (field := _blur_field(note, ord)) is None:
+        return changed
+
+    value = note.fields[ord]
+    minimized = config["minimized"]
+
+    # fields that would block the editor for longer than the budget are formatted in the background
+    if _LATENCY.estimate(field.formatter_name, value) > config["budgetMs"] / 1000:
+        mw.taskman.run_in_background(
+            lambda: _format_field(field, value, minimized),
+            lambda future: _apply_deferred(future, note, field, value),
+        )
+        return changed
+
+    formatted_value = _format_field(field, value, minimized)
+    if formatted_value is None:
+        return changed
+
+    note.fields[ord] = formatted_value
+    _save_note(note)
+
+    return True
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+
+from anki_formatter.cache import value_hash
+
+DEFAULT_SIZE = 10000
+
+
+class FormatterMemo:
+    def __init__(self, size: int = DEFAULT_SIZE) -> None:
+        self.size = size
+
+        self.hits = 0
+        self.misses = 0
+
+        # least recently used entries first
+        self.__results: OrderedDict[tuple[str, bool, bytes], tuple[str, bool]] = OrderedDict()
+
+    def __contains__(self, key: tuple[str, str, bool]) -> bool:
+        formatter, value, minimized = key
+
+        return (formatter, minimized, value_hash(value)) in self.__results
+
+    def get(self, formatter: str, value: str, minimized: bool) -> tuple[str, bool] | None:
+        key = (formatter, minimized, value_hash(value))
+
+        result = self.__results.get(key)
+        if result is None:
+            return None
+
+        self.hits += 1
+        self.__results.move_to_end(key)
+
+        return result
+
+    def add(self, formatter: str, value: str, minimized: bool, result: tuple[str, bool]) -> None:
+        # every formatted value is added once, so additions are the misses
+        self.misses += 1
+        key = (formatter, minimized, value_hash(value))
+
+        self.__results[key] = result
+        self.__results.move_to_end(key)
+
+        if len(self.__results) > self.size:
+            self.__results.popitem(last=False)
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import json
+import math
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from itertools import accumulate
+from typing import Any
+
+PERCENTILES = (50, 90, 99)
+
+# latencies are counted in logarithmic buckets from 1 µs up, so every metric has a fixed size and
+# the percentiles are at most 9 % too high
+MIN_SECONDS = 1e-6
+BUCKETS_PER_OCTAVE = 8
+MAX_BUCKET = 30 * BUCKETS_PER_OCTAVE  # about 18 minutes
+
+
+def _bucket(seconds: float) -> int:
+    if seconds <= MIN_SECONDS:
+        return 0
+
+    return min(math.ceil(math.log2(seconds / MIN_SECONDS) * BUCKETS_PER_OCTAVE), MAX_BUCKET)
+
+
+def _bucket_seconds(bucket: int) -> float:
+    # the upper bound of the bucket
+    return MIN_SECONDS * 2 ** (bucket / BUCKETS_PER_OCTAVE)
+
+
+class Metric:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.changed = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.latencies: dict[int, int] = {}  # number of calls per bucket
+
+    def record(
+        self,
+        seconds: float,
+        bytes_in: int,
+        bytes_out: int,
+        changed: bool,
+        failed: bool = False,
+    ) -> None:
+        self.calls += 1
+        self.changed += changed
+        self.errors += failed
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+        bucket = _bucket(seconds)
+        self.latencies[bucket] = self.latencies.get(bucket, 0) + 1
+
+    def merge(self, other: Metric) -> None:
+        self.calls += other.calls
+        self.changed += other.changed
+        self.errors += other.errors
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.seconds += other.seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+
+        for bucket, count in other.latencies.items():
+            self.latencies[bucket] = self.latencies.get(bucket, 0) + count
+
+    def percentile(self, percentile: int) -> float:
+        if not self.latencies:
+            return 0.0
+
+        index = round(percentile / 100 * (sum(self.latencies.values()) - 1))
+
+        buckets = sorted(self.latencies)
+        cumulative_calls = accumulate(self.latencies[bucket] for bucket in buckets)
+        bucket = next(bucket for bucket, calls in zip(buckets, cumulative_calls) if calls > index)
+
+        # the last bucket has no upper bound
+        if bucket == MAX_BUCKET:
+            return self.max_seconds
+
+        return min(_bucket_seconds(bucket), self.max_seconds)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "changed": self.changed,
+            "changedRate": round(self.changed / self.calls, 4) if self.calls else 0.0,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 6),
+            **{f"p{p}Ms": round(self.percentile(p) * 1000, 3) for p in PERCENTILES},
+            "maxMs": round(self.max_seconds * 1000, 3),
+            "bytesIn": self.bytes_in,
+            "bytesOut": self.bytes_out,
+        }
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.formatters: dict[str, Metric] = {}
+        self.stages: dict[str, Metric] = {}
+        self.counters: dict[str, int] = {}
+
+    def record(
+        self,
+        formatter: str,
+        seconds: float,
+        value: str,
+        formatted_value: str,
+        changed: bool,
+        failed: bool = False,
+    ) -> None:
+        if formatter not in self.formatters:
+            self.formatters[formatter] = Metric()
+
+        self.formatters[formatter].record(
+            seconds,
+            len(value.encode("utf-8")),
+            len(formatted_value.encode("utf-8")),
+            changed,
+            failed,
+        )
+
+    @contextmanager
+    def stage(self, stage: str) -> Generator[None, None, None]:
+        if stage not in self.stages:
+            self.stages[stage] = Metric()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage].record(time.perf_counter() - start, 0, 0, False)
+
+    def count(self, counter: str, value: int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def merge(self, other: Metrics) -> None:
+        for name, metric in other.formatters.items():
+            self.formatters.setdefault(name, Metric()).merge(metric)
+
+        for name, metric in other.stages.items():
+            self.stages.setdefault(name, Metric()).merge(metric)
+
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "formatters": {
+                name: self.formatters[name].to_dict() for name in sorted(self.formatters)
+            },
+            "stages": {name: self.stages[name].to_dict() for name in sorted(self.stages)},
+            "counters": {name: self.counters[name] for name in sorted(self.counters)},
+        }
+
+    def to_json(self, **summary: object) -> str:
+        return json.dumps({**summary, **self.to_dict()}, indent=2)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import heapq
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import NamedTuple
+
+from anki_formatter.errors import error_message
+from anki_formatter.errors import FieldError
+from anki_formatter.metrics import Metrics
+
+CHUNKS_PER_WORKER = 4
+
+
+class Job(NamedTuple):
+    note_id: int
+    ord: int
+    field: str
+    formatter_name: str
+    formatter: Callable[[str, bool], tuple[str, bool]]
+    value: str
+
+
+class Result(NamedTuple):
+    note_id: int
+    ord: int
+    value: str
+
+
+def balanced_chunks(jobs: list[Job], num_chunks: int) -> list[list[Job]]:
+    # largest jobs first, each into the currently smallest chunk
+    chunks: list[list[Job]] = [[] for _ in range(num_chunks)]
+    sizes = [(0, index) for index in range(num_chunks)]
+
+    for job in sorted(jobs, key=lambda job: len(job.value), reverse=True):
+        size, index = heapq.heappop(sizes)
+        chunks[index].append(job)
+        heapq.heappush(sizes, (size + len(job.value), index))
+
+    return [chunk for chunk in chunks if chunk]
+
+
+def _format_chunk(
+    chunk: list[Job],
+    minimized: bool,
+) -> tuple[list[Result], list[FieldError], Metrics, float]:
+    cpu_start = time.process_time()
+
+    results = []
+    errors = []
+    metrics = Metrics()
+
+    for job in chunk:
+        start = time.perf_counter()
+        try:
+            formatted_value, did_format = job.formatter(job.value, minimized)
+        except Exception as e:
+            metrics.record(
+                job.formatter_name,
+                time.perf_counter() - start,
+                job.value,
+                job.value,
+                False,
+                failed=True,
+            )
+            errors.append(FieldError(job.note_id, job.field, job.formatter_name, error_message(e)))
+            continue
+
+        metrics.record(
+            job.formatter_name,
+            time.perf_counter() - start,
+            job.value,
+            formatted_value,
+            did_format,
+        )
+
+        if did_format:
+            results.append(Result(note_id=job.note_id, ord=job.ord, value=formatted_value))
+
+    return results, errors, metrics, time.process_time() - cpu_start
+
+
+class ParallelFormatter:
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+
+        self.metrics = Metrics()
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+
+        # spawn fresh interpreters, forking a running Qt application is not safe
+        self.__executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+
+    def __enter__(self) -> ParallelFormatter:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.__executor.shutdown(cancel_futures=True)
+
+    @property
+    def speedup(self) -> float:
+        # the summed cpu time of the workers approximates the time a serial run would take
+        return self.cpu_time / self.wall_time if self.wall_time else 1.0
+
+    def format(self, jobs: list[Job], minimized: bool) -> tuple[list[Result], list[FieldError]]:
+        start = time.perf_counter()
+
+        futures = [
+            self.__executor.submit(_format_chunk, chunk, minimized)
+            for chunk in balanced_chunks(jobs, self.workers * CHUNKS_PER_WORKER)
+        ]
+
+        results: list[Result] = []
+        errors: list[FieldError] = []
+        for future in futures:
+            chunk_results, chunk_errors, metrics, cpu_time = future.result()
+            results += chunk_results
+            errors += chunk_errors
+
+            self.metrics.merge(metrics)
+            self.cpu_time += cpu_time
+
+        self.wall_time += time.perf_counter() - start
+
+        return results, errors
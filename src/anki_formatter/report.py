@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import json
+from difflib import SequenceMatcher
+from typing import NamedTuple
+
+from anki_formatter.errors import FieldError
+from anki_formatter.metrics import Metrics
+
+DIFF_CONTEXT = 20
+
+
+class Change(NamedTuple):
+    note_id: int
+    field: str
+    formatter: str
+    diff: str
+
+
+def compact_diff(original: str, formatted: str) -> str:
+    parts = []
+
+    matcher = SequenceMatcher(None, original, formatted, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+
+        context_start = max(i1 - DIFF_CONTEXT, 0)
+        context = original[context_start:i1].replace("\n", "⏎")
+        removed = original[i1:i2].replace("\n", "⏎")
+        added = formatted[j1:j2].replace("\n", "⏎")
+
+        part = f"…{context}"
+        if removed:
+            part += f"[-{removed}-]"
+        if added:
+            part += f"{{+{added}+}}"
+
+        parts.append(part)
+
+    return " ".join(parts)
+
+
+class DryRunReport:
+    def __init__(self, minimized: bool) -> None:
+        self.minimized = minimized
+
+        self.notes = 0
+        self.seconds = 0.0
+
+        self.changes: list[Change] = []
+        self.metrics = Metrics()
+        self.errors: list[FieldError] = []
+
+    def add_change(
+        self,
+        note_id: int,
+        field: str,
+        formatter: str,
+        original: str,
+        formatted: str,
+    ) -> None:
+        self.changes.append(Change(note_id, field, formatter, compact_diff(original, formatted)))
+
+    @property
+    def changed_notes(self) -> int:
+        return len({change.note_id for change in self.changes})
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "minimized": self.minimized,
+                "notes": self.notes,
+                "changedNotes": self.changed_notes,
+                "seconds": round(self.seconds, 3),
+                "notesPerSecond": round(self.notes / self.seconds, 1) if self.seconds else None,
+                **self.metrics.to_dict(),
+                "changes": [
+                    {
+                        "noteId": change.note_id,
+                        "field": change.field,
+                        "formatter": change.formatter,
+                        "diff": change.diff,
+                    }
+                    for change in self.changes
+                ],
+                "errors": [
+                    {
+                        "noteId": error.note_id,
+                        "field": error.field,
+                        "formatter": error.formatter,
+                        "message": error.message,
+                    }
+                    for error in self.errors
+                ],
+            },
+            ensure_ascii=False,
+            indent=2,
+        )
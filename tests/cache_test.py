@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from anki_formatter.cache import CanonicalCache
+
+
+@pytest.mark.parametrize(
+    ("formatter", "value", "minimized", "expected_output"),
+    (
+        ("html", "<b>foo</b>", False, True),
+        ("html", "<b>foo</b>", True, False),
+        ("html", "<b>bar</b>", False, False),
+        ("plaintext", "<b>foo</b>", False, False),
+        ("html:0123", "<b>foo</b>", False, False),
+    ),
+)
+def test_canonical_cache(
+    tmp_path: Path,
+    formatter: str,
+    value: str,
+    minimized: bool,
+    expected_output: bool,
+) -> None:
+    cache = CanonicalCache(str(tmp_path / "cache.db"))
+    cache.add("html", "<b>foo</b>", False)
+    cache.commit()
+    cache.close()
+
+    cache = CanonicalCache(str(tmp_path / "cache.db"))
+    assert cache.is_canonical(formatter, value, minimized) == expected_output
+    cache.close()
+
+
+def test_canonical_cache_uncommitted(tmp_path: Path) -> None:
+    cache = CanonicalCache(str(tmp_path / "cache.db"))
+    cache.add("html", "foo", False)
+    cache.close()
+
+    cache = CanonicalCache(str(tmp_path / "cache.db"))
+    assert not cache.is_canonical("html", "foo", False)
+    cache.close()
+
+
+@pytest.mark.parametrize(
+    ("formatter", "versions", "expected_output"),
+    (
+        ("html", {"html": 1}, True),
+        ("html", {"html": 2}, False),
+        ("html:0123", {"html": 1}, True),
+        ("html:0123", {"html": 2}, False),
+        ("html", {"html": 1, "plaintext": 2}, True),
+    ),
+)
+def test_canonical_cache_version(
+    tmp_path: Path,
+    formatter: str,
+    versions: dict[str, int],
+    expected_output: bool,
+) -> None:
+    with patch.dict("anki_formatter.cache.VERSIONS", {"html": 1, "plaintext": 1}):
+        cache = CanonicalCache(str(tmp_path / "cache.db"))
+        cache.add(formatter, "foo", False)
+        cache.commit()
+        cache.close()
+
+    with patch.dict("anki_formatter.cache.VERSIONS", versions):
+        cache = CanonicalCache(str(tmp_path / "cache.db"))
+        assert cache.is_canonical(formatter, "foo", False) == expected_output
+        cache.close()
+
+    # rows of older versions are removed, they are not canonical after going back either
+    with patch.dict("anki_formatter.cache.VERSIONS", {"html": 1, "plaintext": 1}):
+        cache = CanonicalCache(str(tmp_path / "cache.db"))
+        assert cache.is_canonical(formatter, "foo", False) == expected_output
+        cache.close()
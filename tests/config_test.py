@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from anki_formatter.config import ConfigError
+from anki_formatter.config import load_config
+from anki_formatter.formatters.clear import clear
+from anki_formatter.formatters.html import format_html
+
+
+def _write_model(directory: Path, data: object, folder: str = "Model") -> None:
+    (directory / folder).mkdir(exist_ok=True)
+    path = directory / folder / "model.json"
+    path.write_text(data if isinstance(data, str) else json.dumps(data), encoding="utf-8")
+
+    # every write gets a new modification time, even on file systems with a coarse resolution
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def _note_type(
+    name: str,
+    fields: list[str],
+    note_type_id: int = 1,
+    mod: int = 1,
+) -> dict[str, Any]:
+    return {
+        "id": note_type_id,
+        "mod": mod,
+        "name": name,
+        "flds": [{"name": field, "ord": ord} for ord, field in enumerate(fields)],
+    }
+
+
+@pytest.mark.parametrize(
+    ("data", "message"),
+    (
+        ("{", "Expecting property name"),
+        ([], '"name" must be a string'),
+        ({"name": "Model"}, '"fields" must be a list'),
+        ({"name": "Model", "fields": [{"formatter": "html"}]}, 'field 0 must have a "name"'),
+        (
+            {"name": "Model", "fields": [{"name": "Text", "formatter": "foo"}]},
+            'unknown formatter "foo" of field "Text"',
+        ),
+        (
+            {"name": "Model", "fields": [{"name": "Text", "formatter": "clear", "policy": {}}]},
+            'field "Text" has a policy but no html formatter',
+        ),
+        (
+            {"name": "Model", "fields": [{"name": "Text", "formatter": "html", "policy": []}]},
+            '"policy" of field "Text" must be an object',
+        ),
+        (
+            {
+                "name": "Model",
+                "fields": [{"name": "Text", "formatter": "html", "policy": {"tags": ["hr"]}}],
+            },
+            'invalid policy of field "Text": "tags" contains the unsupported tags hr',
+        ),
+    ),
+)
+def test_load_config_invalid(tmp_path: Path, data: object, message: str) -> None:
+    _write_model(tmp_path, data)
+
+    with pytest.raises(ConfigError, match=message):
+        load_config(str(tmp_path), [])
+
+
+def test_load_config_missing_directory(tmp_path: Path) -> None:
+    with pytest.raises(ConfigError, match="templates does not exist"):
+        load_config(str(tmp_path / "templates"), [])
+
+
+def test_load_config_missing_model(tmp_path: Path) -> None:
+    (tmp_path / "Model").mkdir()
+    (tmp_path / ".git").mkdir()
+
+    with pytest.raises(ConfigError, match="model.json does not exist"):
+        load_config(str(tmp_path), [])
+
+
+def test_load_config(tmp_path: Path) -> None:
+    _write_model(
+        tmp_path,
+        {
+            "name": "Model",
+            "fields": [
+                {"name": "Text", "formatter": "html"},
+                {"name": "Extra", "formatter": "html", "policy": {"tags": ["b"]}},
+                {"name": "Notes", "formatter": "clear"},
+                {"name": "Id"},
+            ],
+        },
+    )
+    (tmp_path / ".git").mkdir()
+    (tmp_path / "README.md").write_text("", encoding="utf-8")
+
+    plan = load_config(
+        str(tmp_path),
+        [
+            _note_type("Model (copy)", ["Id", "Text", "Extra", "Notes"], note_type_id=1),
+            _note_type("Other", ["Text"], note_type_id=2),
+            _note_type("Model", ["Text", "Unknown"], note_type_id=3),
+        ],
+    )
+
+    assert [(field.ord, field.name, field.formatter_name) for field in plan.fields[1]] == [
+        (1, "Text", "html"),
+        (2, "Extra", "html"),
+        (3, "Notes", "clear"),
+    ]
+    assert plan.fields[1][0].formatter is format_html
+    assert plan.fields[1][2].formatter is clear
+    assert plan.fields[1][0].cache_key == "html"
+    assert plan.fields[1][1].cache_key.startswith("html:")
+    assert plan.fields[1][1].formatter("<i>foo</i> <b>bar</b>", False) == ("foo <b>bar</b>", True)
+
+    assert list(plan.fields) == [1]
+    assert plan.errors == {3: ["Unknown"]}
+
+
+def test_load_config_reload(tmp_path: Path) -> None:
+    note_types = [_note_type("Model", ["Text"])]
+
+    _write_model(tmp_path, {"name": "Model", "fields": [{"name": "Text", "formatter": "html"}]})
+    plan = load_config(str(tmp_path), note_types)
+
+    # unchanged model files and note types are not read and compiled again
+    assert load_config(str(tmp_path), note_types) is plan
+    assert load_config(str(tmp_path), [_note_type("Model", ["Text"], mod=2)]) is not plan
+
+    # the plans of other note types do not replace each other
+    note_types = [_note_type("Model", ["Text"], mod=2)]
+    all_note_types = [*note_types, _note_type("Model 2", ["Text"], note_type_id=2)]
+    plan = load_config(str(tmp_path), note_types)
+    all_plan = load_config(str(tmp_path), all_note_types)
+    assert load_config(str(tmp_path), note_types) is plan
+    assert load_config(str(tmp_path), all_note_types) is all_plan
+
+    _write_model(tmp_path, {"name": "Model", "fields": [{"name": "Text", "formatter": "clear"}]})
+    plan = load_config(str(tmp_path), note_types)
+    assert plan.fields[1][0].formatter is clear
+
+    _write_model(tmp_path, {"name": "Other", "fields": []}, folder="Other")
+    assert load_config(str(tmp_path), note_types) is not plan
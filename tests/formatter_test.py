@@ -1,13 +1,24 @@
 from __future__ import annotations
 
+from collections.abc import Callable
+from functools import partial
 from unittest.mock import Mock
 from unittest.mock import patch
 
 import pytest
 
+from anki_formatter.formatters import is_pure
+from anki_formatter.formatters import READ_ONLY_FORMATTERS
+from anki_formatter.formatters import with_media_directory
 from anki_formatter.formatters.clear import clear
+from anki_formatter.formatters.common import InvalidValueError
 from anki_formatter.formatters.date import format_date
 from anki_formatter.formatters.html import format_html
+from anki_formatter.formatters.html import html_policy
+from anki_formatter.formatters.html import HTMLParser
+from anki_formatter.formatters.html import postprocess
+from anki_formatter.formatters.html import preprocess
+from anki_formatter.formatters.image_occlusion_svg import format_image_occlusion_field
 from anki_formatter.formatters.image_occlusion_svg import format_image_occlusion_svg
 from anki_formatter.formatters.links import format_links
 from anki_formatter.formatters.meditricks import format_meditricks
@@ -26,6 +37,8 @@ def mocked_links_requests(url: str, timeout: int | None = None) -> Mock:
         "https://www.gelbe-liste.de/wirkstoffe/Aciclovir_231": "<html><title>Aciclovir - Anwendung, Wirkung, Nebenwirkungen | Gelbe Liste</title></html>",  # noqa: E501
         "https://www.gelbe-liste.de/produkte/Metamizol-AbZ-500-mg-Tabletten_541825": "<html><title>Metamizol AbZ 500 mg Tabletten | Gelbe Liste</title></html>",  # noqa: E501
         "https://www.embryotox.de/arzneimittel/details/ansicht/medikament/ganciclovir": "<html><title>Embryotox - Ganciclovir</title></html>",  # noqa: E501
+        "https://de.wikipedia.org/wiki/Wikipedia:Hauptseite": "<html><title>Wikipedia</title></html>",  # noqa: E501
+        "https://de.wikipedia.org/wiki/Niere": """<!DOCTYPE html><html lang="de"><head><meta charset="UTF-8"><script>if (a < b) {}</script><title>Niere &ndash; Wikipedia</title></head><body><div><p>Die <b>Niere</b> <a href="/wiki/Organ">Organ</a></div></body></html>""",  # noqa: E501
     }[url]
 
     return mock_resp
@@ -438,6 +451,74 @@ def test_occlusion_formatter(input: str, expected_output: str) -> None:
             """<td style="foo: bar">foobar</td>""",
             """<td>foobar</td>""",
         ),
+        (
+            """<b>foo</b><b> </b><ul><li>x</li></ul>""",
+            """<b>foo</b>\n<ul>\n  <li>x</li>\n</ul>""",
+        ),
+        (
+            """foo,<i></i><b> </b><br>""",
+            """foo,<br>""",
+        ),
+        (
+            """<td rowspan="2" colspan="3">foo</td><td style="text-align: center" colspan="2">bar</td>""",  # noqa: E501
+            """<td colspan="3" rowspan="2">foo</td>\n<td colspan="2" style="text-align: center;">bar</td>""",  # noqa: E501
+        ),
+        (
+            """<!-- comment -->text<!DOCTYPE html><![CDATA[foo]]><![if bar]><?baz>""",
+            """text""",
+        ),
+        (
+            """<pre><b>foo</b>\n  <b>bar</b></pre>""",
+            """<b>foobar</b>""",
+        ),
+        (
+            """<b>foo<i>bar</b>baz</i></u>""",
+            """<b>foo<i>bar</i></b>baz""",
+        ),
+        (
+            """A&#66;&#x43; &#150; &#129; &#0;""",
+            """ABC – \x81 �""",
+        ),
+        (
+            """&foo; &amp; 1 &lt; 2""",
+            """&foo & 1 < 2""",
+        ),
+        (
+            """foo<br></br>bar<b/>""",
+            """foo<br>\nbar""",
+        ),
+        (
+            """foo ☷ <b>bar</b> ☰ baz""",
+            """foo ☷ <b>bar</b> ☰ baz""",
+        ),
+        (
+            """<li>☷ foo</li>""",
+            """<li>☷ foo</li>""",
+        ),
+        (
+            """<b><i><u>foo</u></i></b> <b><i><u>bar</u></i></b>""",
+            """<b><i><u>foo bar</u></i></b>""",
+        ),
+        (
+            """foo bar <""",
+            """foo bar <""",
+        ),
+        (
+            """<b>foo<b>bar</b></b>""",
+            """<b>foobar</b>""",
+        ),
+        (
+            """<ul><li>foo</li><li></li></ul>""",
+            """<ul>\n  <li>foo</li>\n</ul>""",
+        ),
+        (
+            """foo\ufdd0bar""",
+            """foobar""",
+        ),
+        (
+            """<ul><li>foo\ufdd1</li><li>&#xfdd0;bar</li></ul>""",
+            """<ul>\n  <li>foo</li>\n  <li>bar</li>\n</ul>""",
+        ),
     ),
 )
 def test_html_formatter(input: str, expected_output: str) -> None:
@@ -455,6 +536,26 @@ def test_html_formatter(input: str, expected_output: str) -> None:
             """<section>\n  foo<br>\n  <b>bar</b>\n</section>""",
             """<section>foo<br><b>bar</b></section>""",
         ),
+        (
+            """<i>Insulin</i><b>bar</b>""",
+            """<i>Insulin</i><b>bar</b>""",
+        ),
+        (
+            """<ul><li>foo <b>bar</b><ol><li>baz</li></ol></li></ul>""",
+            """<ul><li>foo <b>bar</b><ol><li>baz</li></ol></li></ul>""",
+        ),
+        (
+            """<b>foo</b><b> </b><ul><li>x</li></ul>""",
+            """<b>foo</b><ul><li>x</li></ul>""",
+        ),
+        (
+            """foo,<i></i><b> </b><br>""",
+            """foo,<br>""",
+        ),
+        (
+            """<table border="1" style="border-collapse: collapse;"><tr><td rowspan="2" colspan="3">foo</td></tr></table>""",  # noqa: E501
+            """<table border="1" style="border-collapse: collapse;"><tr><td colspan="3" rowspan="2">foo</td></tr></table>""",  # noqa: E501
+        ),
     ),
 )
 def test_html_formatter_minimized(input: str, expected_output: str) -> None:
@@ -465,6 +566,121 @@ def test_html_formatter_minimized(input: str, expected_output: str) -> None:
     assert ret_2 == expected_output
 
 
+@pytest.mark.parametrize(
+    "input",
+    (
+        "",
+        " \n ",
+        " foo  bar\nbaz ",
+        "foo\ufeff\u00adbar",
+        "„foo“\xa0-> bar => baz",
+        "\\(a -> b\\) -> c",
+        "foo . bar , baz :",
+        "{{c1:: foo :: bar }}",
+        "\ufdd0. foo \ufdd1 bar\ufdd0",
+    ),
+)
+def test_html_formatter_plain_text(input: str) -> None:
+    parser = HTMLParser()
+    parser.feed_tree(preprocess(input))
+    expected_output = postprocess(parser.get_parsed_string())
+
+    assert format_html(input, False) == (expected_output, input != expected_output)
+    assert format_html(input, True) == (expected_output, input != expected_output)
+
+
+@pytest.mark.parametrize(
+    ("policy", "input", "expected_output"),
+    (
+        (
+            {"tags": ["b", "br"]},
+            """<section><i>foo</i><b>bar</b><br>baz</section>""",
+            """foo<b>bar</b><br>\nbaz""",
+        ),
+        (
+            {"emptyTags": ["br", "img"]},
+            """<table><tr><td>foo</td><td></td></tr></table>""",
+            """<table border="1" style="border-collapse: collapse;">\n  <tr>\n    <td>foo</td>\n  </tr>\n</table>""",  # noqa: E501
+        ),
+        (
+            {
+                "attrs": {
+                    "td": {"style": {"color": "*", "text-align": ["left"]}},
+                    "ol": {"type": "*"},
+                }
+            },
+            """<ol start="3" type="a"><li>foo</li></ol><table><tr><td style="color: red; text-align: center" colspan="2">foo</td></tr></table>""",  # noqa: E501
+            """<ol type="a">\n  <li>foo</li>\n</ol>\n<table border="1" style="border-collapse: collapse;">\n  <tr>\n    <td style="color: red;">foo</td>\n  </tr>\n</table>""",  # noqa: E501
+        ),
+        (
+            {"requiredAttrs": {"table": {"style": {"width": "100%"}, "border": "0"}}},
+            """<table><tr><td>foo</td></tr></table>""",
+            """<table style="width: 100%;" border="0">\n  <tr>\n    <td>foo</td>\n  </tr>\n</table>""",  # noqa: E501
+        ),
+    ),
+)
+def test_html_formatter_policy(policy: dict[str, object], input: str, expected_output: str) -> None:
+    ret_1, _ = format_html(input, False, html_policy(policy))
+    ret_2, _ = format_html(ret_1, False, html_policy(policy))
+
+    assert ret_1 == expected_output
+    assert ret_2 == expected_output
+
+
+@pytest.mark.parametrize(
+    ("policy", "message"),
+    (
+        ({"tag": ["b"]}, "unknown keys tag"),
+        ({"tags": "b"}, '"tags" must be a list of tags'),
+        ({"emptyTags": ["br", "hr"]}, '"emptyTags" contains the unsupported tags hr'),
+        ({"attrs": ["img"]}, '"attrs" must map tags to their attrs'),
+        ({"attrs": {"img": {"src": ["a.jpg"]}}}, 'attr "src" of "img" must be "\\*"'),
+        ({"requiredAttrs": {"table": "border"}}, '"requiredAttrs" must map tags to their attrs'),
+        ({"requiredAttrs": {"table": {"border": 1}}}, 'required attr "border" of "table"'),
+    ),
+)
+def test_html_policy_invalid(policy: dict[str, object], message: str) -> None:
+    with pytest.raises(ValueError, match=message):
+        html_policy(policy)
+
+
+@pytest.mark.parametrize(
+    ("formatter", "expected_output"),
+    (
+        (format_html, True),
+        (partial(format_html, policy=html_policy({"tags": ["b"]})), True),
+        (format_links, False),
+    ),
+)
+def test_is_pure(formatter: Callable[[str, bool], tuple[str, bool]], expected_output: bool) -> None:
+    assert is_pure(formatter) == expected_output
+
+
+@pytest.mark.parametrize(
+    ("formatter", "expected_keywords"),
+    (
+        (format_html, None),
+        (format_image_occlusion_field, {"media_directory": "media"}),
+        (
+            READ_ONLY_FORMATTERS[format_image_occlusion_field],
+            {"write_media": False, "media_directory": "media"},
+        ),
+    ),
+)
+def test_with_media_directory(
+    formatter: Callable[[str, bool], tuple[str, bool]],
+    expected_keywords: dict[str, object] | None,
+) -> None:
+    formatter_with_media = with_media_directory(formatter, "media")
+
+    if expected_keywords is None:
+        assert formatter_with_media is formatter
+    else:
+        assert isinstance(formatter_with_media, partial)
+        assert formatter_with_media.func is format_image_occlusion_field
+        assert formatter_with_media.keywords == expected_keywords
+
+
 @pytest.mark.parametrize(
     ("input", "expected_output"),
     (
@@ -485,6 +701,18 @@ def test_date_formatter(input: str, expected_output: str) -> None:
     assert ret_2 == expected_output
 
 
+@pytest.mark.parametrize(
+    "input",
+    (
+        "foobar",
+        "2024-06-03",
+    ),
+)
+def test_date_formatter_invalid(input: str) -> None:
+    with pytest.raises(InvalidValueError, match="Unknown date format"):
+        format_date(input, False)
+
+
 @pytest.mark.parametrize(
     ("input", "expected_output"),
     (
@@ -502,6 +730,19 @@ def test_source_formatter(input: str, expected_output: str) -> None:
     assert ret_2 == expected_output
 
 
+@pytest.mark.parametrize(
+    "input",
+    (
+        "foobar",
+        "AMBOSS, foobar",
+        "AMBOSS,Wikipedia",
+    ),
+)
+def test_source_formatter_invalid(input: str) -> None:
+    with pytest.raises(InvalidValueError, match="Unknown source"):
+        format_source(input, False)
+
+
 @pytest.mark.parametrize(
     ("input", "expected_output"),
     (
@@ -523,6 +764,22 @@ def test_meditricks_formatter(input: str, expected_output: str) -> None:
     assert ret_2 == expected_output
 
 
+@pytest.mark.parametrize(
+    "input",
+    (
+        """foobar""",
+        """<div class="mt-anki-iframe-src" data-src="1"></div><div></div>""",
+        """<span class="mt-anki-iframe-src" data-src="1709395038956"></span>""",
+        """<div data-src="1709395038956"></div>""",
+        """<div class="mt-anki-iframe-src" data-src="foobar"></div>""",
+        """<div class="mt-anki-iframe-src"></div>""",
+    ),
+)
+def test_meditricks_formatter_invalid(input: str) -> None:
+    with pytest.raises(InvalidValueError, match="Invalid meditricks"):
+        format_meditricks(input, False)
+
+
 @pytest.mark.parametrize(
     ("input", "expected_output"),
     (
@@ -565,6 +822,36 @@ def test_links_formatter(mock_get: Mock, input: str, expected_output: str) -> No
     assert ret_2 == expected_output
 
 
+@pytest.mark.parametrize("parser", ("html.parser", "lxml"))
+@pytest.mark.parametrize(
+    ("input", "expected_output"),
+    (
+        (
+            """<a href="https://de.wikipedia.org/wiki/Niere">Niere</a>""",
+            """<a href="https://de.wikipedia.org/wiki/Niere">Niere – Wikipedia</a>""",
+        ),
+        (
+            """<a href="https://www.embryotox.de/arzneimittel/details/ansicht/medikament/ganciclovir">foo</a>""",  # noqa: E501
+            """<a href="https://www.embryotox.de/arzneimittel/details/ansicht/medikament/ganciclovir">Ganciclovir – Embryotox</a>""",  # noqa: E501
+        ),
+    ),
+)
+@patch("anki_formatter.formatters.common.requests.get", side_effect=mocked_links_requests)
+def test_links_formatter_document_parser(
+    mock_get: Mock,
+    input: str,
+    expected_output: str,
+    parser: str,
+) -> None:
+    if parser == "lxml":
+        pytest.importorskip("lxml")
+
+    with patch("anki_formatter.formatters.common.DOCUMENT_PARSER", parser):
+        ret, _ = format_links(input, False)
+
+    assert ret == expected_output
+
+
 @pytest.mark.parametrize(
     ("input", "expected_output"),
     (
@@ -587,6 +874,37 @@ def test_links_formatter_minimized(mock_get: Mock, input: str, expected_output:
     assert ret_2 == expected_output
 
 
+@pytest.mark.parametrize(
+    ("input", "expected_message"),
+    (
+        (
+            """foobar""",
+            "Invalid link",
+        ),
+        (
+            """<b>foobar</b>""",
+            "Invalid link",
+        ),
+        (
+            """<a>foobar</a>""",
+            "Invalid link",
+        ),
+        (
+            """<a href="https://example.com">foobar</a>""",
+            "Unknown website",
+        ),
+        (
+            """<a href="https://de.wikipedia.org/wiki/Wikipedia:Hauptseite">foobar</a>""",
+            "Could not parse website title",
+        ),
+    ),
+)
+@patch("anki_formatter.formatters.common.requests.get", side_effect=mocked_links_requests)
+def test_links_formatter_invalid(mock_get: Mock, input: str, expected_message: str) -> None:
+    with pytest.raises(InvalidValueError, match=expected_message):
+        format_links(input, False)
+
+
 @pytest.mark.parametrize(
     ("input", "expected_output"),
     (
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import json
+from collections.abc import Generator
+from pathlib import Path
+
+import pytest
+from anki.collection import Collection
+from anki.decks import DeckId
+from anki.notes import NoteId
+
+from anki_formatter.config import FieldPlan
+from anki_formatter.config import Plan
+from anki_formatter.errors import FieldError
+from anki_formatter.formatters.date import format_date
+from anki_formatter.formatters.html import format_html
+from anki_formatter.formatting import BatchFormatter
+from anki_formatter.formatting import FormattingError
+from anki_formatter.formatting import modified_note_ids
+from anki_formatter.formatting import Options
+from anki_formatter.parallel import ParallelFormatter
+
+OPTIONS = Options(minimized=False, workers=1, threshold=1000, chunk_size=1, cache_path=None)
+
+
+@pytest.fixture
+def col(tmp_path: Path) -> Generator[Collection, None, None]:
+    col = Collection(str(tmp_path / "collection.anki2"))
+    yield col
+    col.close()
+
+
+def _upper(value: str, minimized: bool) -> tuple[str, bool]:
+    # not a pure formatter, so it is never sent to the worker processes
+    return value.upper(), value != value.upper()
+
+
+def _plan(col: Collection, back: FieldPlan | None = None) -> Plan:
+    note_type = col.models.by_name("Basic")
+    assert note_type
+
+    return Plan(
+        fields={
+            note_type["id"]: [
+                FieldPlan(0, "Front", "html", "html", format_html),
+                back or FieldPlan(1, "Back", "upper", "upper", _upper),
+            ],
+        },
+        errors={},
+    )
+
+
+def _add_notes(col: Collection, fronts: list[str], back: str = "") -> list[NoteId]:
+    note_type = col.models.by_name("Basic")
+    assert note_type
+
+    note_ids = []
+    for front in fronts:
+        note = col.new_note(note_type)
+        note["Front"] = front
+        note["Back"] = back
+        col.add_note(note, DeckId(1))
+        note_ids.append(note.id)
+
+    return note_ids
+
+
+def _fronts(col: Collection, note_ids: list[NoteId]) -> list[str]:
+    return [col.get_note(note_id)["Front"] for note_id in note_ids]
+
+
+def _backs(col: Collection, note_ids: list[NoteId]) -> list[str]:
+    return [col.get_note(note_id)["Back"] for note_id in note_ids]
+
+
+@pytest.mark.parametrize(("workers", "threshold"), ((1, 0), (2, 1000), (2, 0)))
+def test_format_notes(tmp_path: Path, col: Collection, workers: int, threshold: int) -> None:
+    fronts = ["<strong>foo</strong>", "<b>bar</b>", "<strong>foo</strong>", "baz"]
+    note_ids = _add_notes(col, fronts, "back")
+    options = OPTIONS._replace(
+        workers=workers,
+        threshold=threshold,
+        chunk_size=3,
+        cache_path=str(tmp_path / "cache.sqlite"),
+        metrics_path=str(tmp_path / "metrics.json"),
+    )
+
+    result = BatchFormatter(_plan(col), options).format_notes(col, note_ids)
+
+    assert (result.total, result.processed, result.formatted) == (4, 4, 4)
+    assert (result.speedup is not None) == (workers > 1 and threshold == 0)
+    assert result.errors == []
+    assert result.report is None
+    assert _fronts(col, note_ids) == ["<b>foo</b>", "<b>bar</b>", "<b>foo</b>", "baz"]
+    assert _backs(col, note_ids) == ["BACK"] * 4
+    assert json.loads((tmp_path / "metrics.json").read_text())["formattedNotes"] == 4
+
+    # the second run finds the canonical values in the cache, the formatted value is checked once
+    result = BatchFormatter(_plan(col), options).format_notes(col, note_ids)
+
+    assert (result.processed, result.formatted) == (4, 0)
+    assert result.metrics.counters["memoMisses"] == 1
+
+
+@pytest.mark.parametrize("workers", (1, 2))
+def test_format_notes_dry_run(col: Collection, workers: int) -> None:
+    fronts = ["<strong>foo</strong>", "<b>bar</b>", "<strong>foo</strong>"]
+    note_ids = _add_notes(col, fronts, "back")
+    options = OPTIONS._replace(workers=workers, threshold=0, dry_run=True, last_run_key="lastRun")
+    undo = col.undo_status().undo
+
+    result = BatchFormatter(_plan(col), options).format_notes(col, note_ids)
+
+    assert result.changes is None
+    assert (result.processed, result.formatted) == (3, 3)
+    assert result.report is not None
+    assert sorted((change.note_id, change.field) for change in result.report.changes) == [
+        (note_ids[0], "Back"),
+        (note_ids[0], "Front"),
+        (note_ids[1], "Back"),
+        (note_ids[2], "Back"),
+        (note_ids[2], "Front"),
+    ]
+    assert _fronts(col, note_ids) == fronts
+    assert _backs(col, note_ids) == ["back"] * 3
+    assert col.get_config("lastRun", None) is None
+    assert col.undo_status().undo == undo
+
+
+@pytest.mark.parametrize("workers", (1, 2))
+def test_format_notes_errors(col: Collection, workers: int) -> None:
+    note_ids = _add_notes(col, ["<strong>foo</strong>"], "x") + _add_notes(col, ["bar"], "")
+    back = FieldPlan(1, "Back", "date", "date", format_date)
+    options = OPTIONS._replace(workers=workers, threshold=0)
+
+    result = BatchFormatter(_plan(col, back), options).format_notes(col, note_ids)
+
+    assert result.errors == [
+        FieldError(note_ids[0], "Back", "date", "Unknown date format: x"),
+    ]
+    assert _fronts(col, note_ids) == ["<b>foo</b>", "bar"]
+    assert _backs(col, note_ids) == ["x", ""]
+
+    with pytest.raises(FormattingError, match=f'field "Back" of note {note_ids[0]}'):
+        BatchFormatter(
+            _plan(col, back),
+            options._replace(stop_on_error=True),
+        ).format_notes(col, note_ids)
+
+
+def test_format_notes_note_types(col: Collection) -> None:
+    note_ids = _add_notes(col, ["<strong>foo</strong>"])
+    note_type = col.models.by_name("Basic")
+    assert note_type
+
+    # notes of note types without a complete config are left unchanged
+    result = BatchFormatter(Plan(fields={}, errors={}), OPTIONS).format_notes(col, note_ids)
+
+    message = 'Could not find a config for note type "Basic".'
+    assert result.errors == [
+        FieldError(note_ids[0], "Front", "", message),
+        FieldError(note_ids[0], "Back", "", message),
+    ]
+
+    result = BatchFormatter(
+        Plan(fields={}, errors={note_type["id"]: ["Back"]}),
+        OPTIONS,
+    ).format_notes(col, note_ids)
+
+    assert result.errors == [
+        FieldError(note_ids[0], "Back", "", "No formatter is configured for this field."),
+    ]
+    assert _fronts(col, note_ids) == ["<strong>foo</strong>"]
+
+
+def test_format_notes_parallel_error(col: Collection, monkeypatch: pytest.MonkeyPatch) -> None:
+    note_ids = _add_notes(col, ["<strong>foo</strong>"])
+
+    def format(*args: object) -> None:
+        raise RuntimeError("broken pool")
+
+    monkeypatch.setattr(ParallelFormatter, "format", format)
+
+    with pytest.raises(FormattingError, match="broken pool"):
+        BatchFormatter(
+            _plan(col),
+            OPTIONS._replace(workers=2, threshold=0),
+        ).format_notes(col, note_ids)
+
+    assert _fronts(col, note_ids) == ["<strong>foo</strong>"]
+
+
+def test_format_notes_cancel(col: Collection) -> None:
+    fronts = [f"<strong>{index}</strong>" for index in range(5)]
+    note_ids = _add_notes(col, fronts)
+    progress: list[int] = []
+
+    result = BatchFormatter(
+        _plan(col),
+        OPTIONS._replace(chunk_size=2, last_run_key="lastRun"),
+        on_progress=lambda processed, total, elapsed: progress.append(processed),
+        want_cancel=lambda: len(progress) == 2,
+    ).format_notes(col, note_ids)
+
+    assert progress == [2, 4]
+    assert (result.total, result.processed, result.formatted) == (5, 4, 4)
+    assert _fronts(col, note_ids) == ["<b>0</b>", "<b>1</b>", "<b>2</b>", "<b>3</b>", fronts[4]]
+    assert col.get_config("lastRun", None) is None
+
+
+def test_modified_note_ids(col: Collection) -> None:
+    assert col.db
+
+    note_ids = _add_notes(col, ["foo", "bar"])
+    since = col.get_note(note_ids[1]).mod
+    note_ids += _add_notes(col, ["baz"])
+    col.db.execute("UPDATE notes SET mod = ? WHERE id = ?", since + 1, note_ids[2])
+
+    assert modified_note_ids(col, _plan(col), "lastRun") == note_ids
+    assert modified_note_ids(col, Plan(fields={}, errors={}), "lastRun") == []
+
+    col.set_config("lastRun", since)
+    assert modified_note_ids(col, _plan(col), "lastRun") == [note_ids[2]]
+
+    col.set_config("lastRunFailedNotes", [note_ids[0]])
+    assert modified_note_ids(col, _plan(col), "lastRun") == [note_ids[0], note_ids[2]]
+
+
+def test_format_notes_last_run(col: Collection) -> None:
+    note_ids = _add_notes(col, ["<strong>foo</strong>"], "x") + _add_notes(col, ["bar"], "")
+    back = FieldPlan(1, "Back", "date", "date", format_date)
+    options = OPTIONS._replace(last_run_key="lastRun")
+
+    BatchFormatter(_plan(col, back), options).format_notes(col, note_ids)
+
+    # the mark advances, the note that could not be formatted is selected again
+    assert col.get_config("lastRun") >= col.get_note(note_ids[0]).mod
+    assert col.get_config("lastRunFailedNotes") == [note_ids[0]]
+    assert modified_note_ids(col, _plan(col, back), "lastRun") == [note_ids[0]]
+
+    note = col.get_note(note_ids[0])
+    note["Back"] = "02.01.2024"
+    col.update_note(note)
+    BatchFormatter(_plan(col, back), options).format_notes(col, [note_ids[0]])
+
+    assert col.get_config("lastRunFailedNotes") == []
+    assert modified_note_ids(col, _plan(col, back), "lastRun") == []
+
+
+def test_format_notes_undo(col: Collection) -> None:
+    # more chunks than Anki keeps undo steps
+    values = [f"<strong>{index}</strong>" for index in range(40)]
+    note_ids = _add_notes(col, values)
+
+    result = BatchFormatter(
+        _plan(col),
+        OPTIONS._replace(last_run_key="lastRun"),
+    ).format_notes(col, note_ids)
+
+    assert result.formatted == 40
+    assert _fronts(col, note_ids) == [f"<b>{index}</b>" for index in range(40)]
+    assert col.undo_status().undo == "Format Notes"
+    assert col.get_config("lastRun", None) is not None
+
+    col.undo()
+
+    assert _fronts(col, note_ids) == values
+    assert col.get_config("lastRun", None) is None
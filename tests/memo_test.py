@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import pytest
+
+from anki_formatter.memo import FormatterMemo
+
+
+@pytest.mark.parametrize(
+    ("lookups", "expected_keys"),
+    (
+        ((), ("bar", "baz")),
+        (("foo",), ("foo", "baz")),
+        (("bar",), ("bar", "baz")),
+        (("foo", "bar"), ("bar", "baz")),
+    ),
+)
+def test_formatter_memo_eviction(lookups: tuple[str, ...], expected_keys: tuple[str, ...]) -> None:
+    memo = FormatterMemo(size=2)
+    memo.add("html", "foo", False, ("<b>foo</b>", True))
+    memo.add("html", "bar", False, ("<b>bar</b>", True))
+
+    for value in lookups:
+        memo.get("html", value, False)
+    memo.add("html", "baz", False, ("baz", False))
+
+    kept = [value for value in ("foo", "bar", "baz") if ("html", value, False) in memo]
+    assert kept == list(expected_keys)
+
+
+@pytest.mark.parametrize(
+    ("formatter", "value", "minimized", "expected_output"),
+    (
+        ("html", "foo", False, ("<b>foo</b>", True)),
+        ("html", "foo", True, None),
+        ("html:0123", "foo", False, None),
+        ("plaintext", "foo", False, None),
+        ("html", "bar", False, None),
+    ),
+)
+def test_formatter_memo(
+    formatter: str,
+    value: str,
+    minimized: bool,
+    expected_output: tuple[str, bool] | None,
+) -> None:
+    memo = FormatterMemo()
+    memo.add("html", "foo", False, ("<b>foo</b>", True))
+
+    assert memo.get(formatter, value, minimized) == expected_output
+    assert ((formatter, value, minimized) in memo) == (expected_output is not None)
+    assert (memo.hits, memo.misses) == (int(expected_output is not None), 1)
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from anki_formatter.metrics import Metric
+from anki_formatter.metrics import Metrics
+
+
+@pytest.mark.parametrize(
+    ("latencies", "percentile", "expected_output"),
+    (
+        ((), 50, 0.0),
+        ((0.0,), 50, 0.0),
+        ((0.002,), 99, 0.002),
+        ((0.001, 0.002, 0.003, 0.004, 1.0), 50, 0.003),
+        ((0.001, 0.002, 0.003, 0.004, 1.0), 0, 0.001),
+        ((0.001, 0.002, 0.003, 0.004, 1.0), 100, 1.0),
+        ((0.001,) * 99 + (0.5,), 90, 0.001),
+        ((0.001,) * 98 + (0.5, 0.5), 99, 0.5),
+        ((10**-6, 10**4), 0, 10**-6),
+        ((10**-6, 10**4), 100, 10**4),
+    ),
+)
+def test_metric_percentile(
+    latencies: tuple[float, ...],
+    percentile: int,
+    expected_output: float,
+) -> None:
+    metric = Metric()
+    for seconds in latencies:
+        metric.record(seconds, 0, 0, False)
+
+    # the percentiles are at most one bucket too high, but never above the maximum
+    assert expected_output <= metric.percentile(percentile) <= expected_output * 1.0906
+
+
+def test_metric_merge() -> None:
+    metric = Metric()
+    metric.record(0.001, 10, 20, True)
+    metric.record(0.003, 10, 10, False, failed=True)
+
+    other = Metric()
+    other.record(0.002, 5, 5, False)
+    other.record(0.004, 5, 5, False)
+    metric.merge(other)
+
+    assert (metric.calls, metric.changed, metric.errors) == (4, 1, 1)
+    assert (metric.bytes_in, metric.bytes_out) == (30, 40)
+    assert metric.seconds == pytest.approx(0.01)
+    assert metric.max_seconds == 0.004
+    assert sum(metric.latencies.values()) == 4
+    assert 0.003 <= metric.percentile(50) <= 0.003 * 1.0906
+
+
+def test_metrics_to_json() -> None:
+    metrics = Metrics()
+    metrics.record("html", 0.001, "<b>ä</b>", "<b>ä</b>", False)
+    metrics.record("html", 0.001, "<b>a</b>", "<b>a</b>", False)
+    with metrics.stage("loadNotes"):
+        pass
+    with metrics.stage("loadNotes"):
+        pass
+    metrics.count("memoHits", 2)
+
+    other = Metrics()
+    other.record("html", 0.001, "<strong>a</strong>", "<b>a</b>", True)
+    other.record("date", 0.001, "x", "x", False, failed=True)
+    with other.stage("loadNotes"):
+        pass
+    other.count("memoHits")
+    metrics.merge(other)
+
+    data = json.loads(metrics.to_json(notes=2))
+
+    assert data["notes"] == 2
+    assert list(data["formatters"]) == ["date", "html"]
+    assert data["formatters"]["html"]["calls"] == 3
+    assert data["formatters"]["html"]["changedRate"] == 0.3333
+    assert data["formatters"]["html"]["bytesIn"] == 35
+    assert data["formatters"]["date"]["errors"] == 1
+    assert data["stages"]["loadNotes"]["calls"] == 3
+    assert data["counters"] == {"memoHits": 3}
+    assert Metric().to_dict()["changedRate"] == 0.0
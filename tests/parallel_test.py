@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import pytest
+
+from anki_formatter.errors import FieldError
+from anki_formatter.formatters.date import format_date
+from anki_formatter.formatters.html import format_html
+from anki_formatter.parallel import balanced_chunks
+from anki_formatter.parallel import Job
+from anki_formatter.parallel import ParallelFormatter
+from anki_formatter.parallel import Result
+
+
+def _job(note_id: int, value: str) -> Job:
+    return Job(
+        note_id=note_id,
+        ord=0,
+        field="Text",
+        formatter_name="html",
+        formatter=format_html,
+        value=value,
+    )
+
+
+@pytest.mark.parametrize(
+    ("sizes", "num_chunks", "expected_output"),
+    (
+        ((), 2, []),
+        ((1,), 3, [[1]]),
+        ((1, 2, 3), 1, [[3, 2, 1]]),
+        ((1, 2, 3, 4), 2, [[4, 1], [3, 2]]),
+        ((6, 1, 1, 1, 1, 1, 1), 2, [[6], [1, 1, 1, 1, 1, 1]]),
+        ((5, 4, 3, 3, 3), 3, [[5], [4, 3], [3, 3]]),
+    ),
+)
+def test_balanced_chunks(
+    sizes: tuple[int, ...],
+    num_chunks: int,
+    expected_output: list[list[int]],
+) -> None:
+    jobs = [_job(index, "x" * size) for index, size in enumerate(sizes)]
+
+    chunks = balanced_chunks(jobs, num_chunks)
+
+    assert [[len(job.value) for job in chunk] for chunk in chunks] == expected_output
+    assert sorted(job.note_id for chunk in chunks for job in chunk) == list(range(len(sizes)))
+
+
+def test_parallel_formatter() -> None:
+    jobs = [
+        _job(1, "<strong>foo</strong>"),
+        _job(2, "<b>bar</b>"),
+        _job(3, "foo"),
+        Job(
+            note_id=3, ord=1, field="Date", formatter_name="date", formatter=format_date, value="x"
+        ),
+    ]
+
+    with ParallelFormatter(2) as parallel:
+        results, errors = parallel.format(jobs, False)
+
+    assert results == [Result(note_id=1, ord=0, value="<b>foo</b>")]
+    assert errors == [FieldError(3, "Date", "date", "Unknown date format: x")]
+    assert parallel.metrics.formatters["html"].calls == 3
+    assert parallel.metrics.formatters["html"].changed == 1
+    assert parallel.metrics.formatters["date"].errors == 1
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from anki_formatter.errors import FieldError
+from anki_formatter.report import compact_diff
+from anki_formatter.report import DryRunReport
+
+
+@pytest.mark.parametrize(
+    ("original", "formatted", "expected_output"),
+    (
+        ("foo", "foo", ""),
+        ("<strong>foo</strong>", "<b>foo</b>", "…<[-strong-]{+b+} …<strong>foo</[-strong-]{+b+}"),
+        ("foo  bar", "foo bar", "…foo [- -]"),
+        ("foo", "foo bar", "…foo{+ bar+}"),
+        (
+            "<ul><li>foo</li></ul>",
+            "<ul>\n  <li>foo</li>\n</ul>",
+            "…<ul>{+⏎  +} …<ul><li>foo</li>{+⏎+}",
+        ),
+        (
+            "0123456789012345678901234567890<b>",
+            "0123456789012345678901234567890<i>",
+            "…2345678901234567890<[-b-]{+i+}",
+        ),
+    ),
+)
+def test_compact_diff(original: str, formatted: str, expected_output: str) -> None:
+    assert compact_diff(original, formatted) == expected_output
+
+
+def test_dry_run_report() -> None:
+    report = DryRunReport(minimized=False)
+    report.notes = 3
+    report.seconds = 0.5
+    report.add_change(1, "Text", "html", "<strong>ä</strong>", "<b>ä</b>")
+    report.add_change(1, "Extra", "html", "foo  bar", "foo bar")
+    report.add_change(2, "Text", "html", "foo  bar", "foo bar")
+    report.errors = [FieldError(3, "Datum", "date", "Unknown date format: x")]
+
+    data = json.loads(report.to_json())
+
+    assert report.changed_notes == 2
+    assert (data["notes"], data["changedNotes"], data["notesPerSecond"]) == (3, 2, 6.0)
+    assert data["changes"][0] == {
+        "noteId": 1,
+        "field": "Text",
+        "formatter": "html",
+        "diff": "…<[-strong-]{+b+} …<strong>ä</[-strong-]{+b+}",
+    }
+    assert data["errors"] == [
+        {"noteId": 3, "field": "Datum", "formatter": "date", "message": "Unknown date format: x"},
+    ]
+    assert json.loads(DryRunReport(minimized=True).to_json())["notesPerSecond"] is None